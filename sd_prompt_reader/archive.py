@@ -0,0 +1,208 @@
+__author__ = "receyuki"
+__filename__ = "archive.py"
+__copyright__ = "Copyright 2024"
+__email__ = "receyuki@gmail.com"
+
+import logging
+import os
+import struct
+import tarfile
+import time
+import zipfile
+from pathlib import Path
+
+from .constants import SUPPORTED_FORMATS
+from .container import PNG_SIGNATURE, mapped, pixels_start, scan
+from .format.base_format import BaseFormat
+from .logger import Logger, log_event
+from .pipeline import bounded_map
+from .result import ParseResult
+from .timing import record_file
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+# members are reported as archive.zip!member.png
+SEPARATOR = "!"
+# bytes read at a time from a compressed member
+READ_SIZE = 64 * 1024
+ZIP_LOCAL_HEADER = struct.Struct("<4s22xHH")
+
+logger = Logger("SD_Prompt_Reader.Archive")
+
+
+def is_archive(path) -> bool:
+    return str(path).lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def read_head(stream) -> bytes:
+    """Read a compressed member up to its pixel data.
+
+    JPEG metadata precedes the pixels, so the stream stops at the first
+    scan. A PNG may also have text after its pixels, so the rest of its
+    stream is walked with the IDAT chunks dropped. It is read to the end
+    when nothing was found before the pixels, as stealth pnginfo lives in
+    them, and for WebP, whose EXIF and XMP follow the image.
+    """
+    from .image_data_reader import ImageDataReader
+
+    data = bytearray()
+    while chunk := stream.read(READ_SIZE):
+        data += chunk
+        if (start := pixels_start(data)) is None:
+            continue
+        container = scan(data)
+        if (
+            container is not None
+            and container.metadata_size
+            and not ImageDataReader.from_container(container).needs_stealth
+        ):
+            if data[:8] == PNG_SIGNATURE:
+                return bytes(data[:start]) + _skip_pixels(data[start:], stream)
+            return bytes(data)
+        data += stream.read()
+        break
+    return bytes(data)
+
+
+def _skip_pixels(pending: bytearray, stream) -> bytes:
+    """The chunks of a PNG stream from its first IDAT on, without the IDATs.
+
+    pending holds what was already read from the stream. IDAT data is
+    dropped as it is read, so the pixels are never held in memory.
+    """
+    kept = bytearray()
+
+    def fill(size: int) -> bool:
+        while len(pending) < size and (chunk := stream.read(READ_SIZE)):
+            pending.extend(chunk)
+        return len(pending) >= size
+
+    while fill(8):
+        length, chunk_type = struct.unpack_from(">I4s", pending)
+        size = length + 12
+        if chunk_type == b"IDAT":
+            while size > len(pending):
+                size -= len(pending)
+                pending.clear()
+                if not fill(1):
+                    return bytes(kept)
+            del pending[:size]
+            continue
+        if not fill(size):
+            break
+        kept += pending[:size]
+        del pending[:size]
+        if chunk_type == b"IEND":
+            break
+    return bytes(kept)
+
+
+class Archive:
+    """The images in a ZIP or TAR archive, read without extracting them.
+
+    Stored ZIP members and the members of an uncompressed TAR are slices
+    of a read-only mmap of the archive, so the scanners only touch their
+    headers. Compressed members are streamed up to their metadata.
+    """
+
+    def __init__(self, path, suffixes=SUPPORTED_FORMATS):
+        self.path = Path(path)
+        self.suffixes = frozenset(suffix.lower() for suffix in suffixes)
+        self._mapped = None
+        self._view = None
+
+    def __enter__(self):
+        self._mapped = mapped(self.path)
+        self._view = memoryview(self._mapped.__enter__())
+        return self
+
+    def __exit__(self, *exc):
+        self._view.release()
+        self._mapped.__exit__(*exc)
+
+    def name(self, member: str) -> str:
+        return f"{self.path}{SEPARATOR}{member}"
+
+    def accept(self, member: str) -> bool:
+        return os.path.splitext(member)[1].lower() in self.suffixes
+
+    def members(self):
+        """Yield (name, buffer) for every image member in archive order."""
+        if zipfile.is_zipfile(self.path):
+            yield from self._zip_members()
+        else:
+            yield from self._tar_members()
+
+    def _zip_members(self):
+        with zipfile.ZipFile(self.path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not self.accept(info.filename):
+                    continue
+                if info.flag_bits & 0x1:
+                    logger.warning(f"跳过加密文件：{self.name(info.filename)}")
+                    continue
+                if info.compress_type == zipfile.ZIP_STORED:
+                    # the data follows the local header, whose name and
+                    # extra field lengths may differ from the central one
+                    _, name_length, extra_length = ZIP_LOCAL_HEADER.unpack_from(
+                        self._view, info.header_offset
+                    )
+                    start = (
+                        info.header_offset
+                        + ZIP_LOCAL_HEADER.size
+                        + name_length
+                        + extra_length
+                    )
+                    data = self._view[start : start + info.file_size]
+                else:
+                    with archive.open(info) as stream:
+                        data = read_head(stream)
+                yield self.name(info.filename), data
+
+    def _tar_members(self):
+        try:
+            archive = tarfile.open(self.path, "r:")
+        except tarfile.ReadError:
+            # compressed, only readable front to back
+            archive = None
+        if archive is not None:
+            with archive:
+                for info in archive:
+                    if info.isfile() and self.accept(info.name):
+                        yield self.name(info.name), self._view[
+                            info.offset_data : info.offset_data + info.size
+                        ]
+            return
+        with tarfile.open(self.path, "r|*") as archive:
+            for info in archive:
+                if info.isfile() and self.accept(info.name):
+                    yield self.name(info.name), read_head(archive.extractfile(info))
+
+
+def read_archive(path, workers: int = 1, window: int = None, **kwargs):
+    """Yield (name, ParseResult) pairs for the images in a ZIP or TAR.
+
+    Members are discovered and read in archive order, and parsed on the
+    workers like the files of read_files.
+    """
+    from .image_data_reader import ImageDataReader
+
+    def read(member):
+        name, data = member
+        start = time.perf_counter()
+        try:
+            result = ImageDataReader.from_buffer(data, slim=True, **kwargs).result
+        except Exception as e:
+            log_event(logger, logging.WARNING, "读取失败", file=name, error=e)
+            result = ParseResult(status=BaseFormat.Status.FORMAT_ERROR)
+        finally:
+            # slices of the mmap must be gone before it is closed
+            if isinstance(data, memoryview):
+                data.release()
+        record_file(name, result.tool, start)
+        return name, result
+
+    try:
+        with Archive(path) as archive:
+            yield from bounded_map(read, archive.members(), workers, window)
+    except (OSError, zipfile.BadZipFile, tarfile.TarError) as e:
+        logger.error(f"无法读取压缩包：{path}（{e}）")
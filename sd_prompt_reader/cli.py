@@ -4,12 +4,138 @@ __copyright__ = "Copyright 2024"
 __email__ = "receyuki@gmail.com"
 
 import json
+import logging
+import sys
+from contextlib import ExitStack
 from pathlib import Path
+from urllib.parse import urlsplit
 
 import click
-from .image_data_reader import ImageDataReader
-from .constants import SUPPORTED_FORMATS
-from .logger import Logger
+from .logger import Logger, log_event
+from .result import FIELD_ALIASES, normalize_fields
+from .walker import read_paths, walk
+
+# the modules behind each mode are imported in its branch, so --help and
+# every single mode only pay for what they use
+
+PROPS_FIELDS = frozenset(FIELD_ALIASES["props"])
+# the modes that work on a list of files rather than a folder or one file
+STDIN_OPERATIONS = ("read", "sniff", "stats", "sweep", "client", "clear")
+
+
+def parse_fields(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return normalize_fields(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def output_stem(file_path: Path, source: Path) -> Path:
+    """The output name of a file, keeping its subfolders under the input folder.
+
+    Files read with --recursive may share a name, so their outputs mirror
+    the tree instead of overwriting each other.
+    """
+    if source.is_dir() and file_path.is_relative_to(source):
+        return file_path.relative_to(source).with_suffix("")
+    return Path(file_path.stem)
+
+
+def export_result(file, image_data, target, source, format_type, fields):
+    logger = Logger("SD_Prompt_Reader.Cli")
+    log_event(logger, logging.DEBUG, "导出文件", file=file)
+    file_path = Path(file)
+    if target.is_dir():
+        logger.debug("输出目录已存在")
+        folder = target
+        stem = output_stem(file_path, source)
+    elif target.is_file():
+        logger.debug("输出文件已存在，将覆盖旧文件")
+        folder = target.parent
+        stem = target.stem
+    else:
+        if target.suffix:
+            logger.debug("输出文件不存在")
+            logger.debug("将创建新文件")
+            folder = target.parent
+            stem = target.stem
+        else:
+            logger.debug("输出目录不存在")
+            logger.debug("将创建新目录")
+            folder = target
+            stem = output_stem(file_path, source)
+        folder.mkdir(parents=True, exist_ok=True)
+    target_file_name = folder / stem
+    target_file_name.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        match format_type:
+            case "TXT":
+                logger.debug("输出格式：TXT")
+                with open(
+                    target_file_name.with_suffix(".txt"),
+                    "w",
+                    encoding="utf-8",
+                ) as f:
+                    f.write(image_data.raw)
+                    logger.debug("导出成功")
+            case "JSON":
+                logger.debug("输出格式：JSON")
+                with open(
+                    target_file_name.with_suffix(".json"),
+                    "w",
+                    encoding="utf-8",
+                ) as f:
+                    if fields is not None:
+                        parameter = image_data.to_dict(fields)
+                    else:
+                        parameter = {
+                            "positive": image_data.positive,
+                            "negative": image_data.negative,
+                            "setting": image_data.setting,
+                        }
+                        parameter.update(image_data.parameter)
+                    json.dump(parameter, f, indent=4)
+                    logger.debug("导出成功")
+            case _:
+                logger.error(f"不支持的输出格式：{format_type}（仅支持 TXT/JSON）")
+    except IOError as e:
+        logger.error(f"保存失败：{e}")
+
+
+def sniff_file(file):
+    from .sniff import SniffResult, sniff
+
+    try:
+        return file, sniff(file)
+    except OSError as e:
+        log_event(
+            Logger("SD_Prompt_Reader.Cli"),
+            logging.WARNING,
+            "读取失败",
+            file=file,
+            error=e,
+        )
+        return file, SniffResult()
+
+
+def rename_export(old, new, target, source, format_type, writer):
+    logger = Logger("SD_Prompt_Reader.Cli")
+    log_event(logger, logging.INFO, "检测到重命名", old=old, new=new)
+    if format_type == "JSONL":
+        # the record of the old path is not repeated, only the move
+        writer.write_record(new, {"renamed_from": str(old)})
+        return
+    # only exports named after the image follow it
+    suffix = {"TXT": ".txt", "JSON": ".json"}.get(format_type)
+    if not suffix or not target or not target.is_dir():
+        return
+    old_export = (target / output_stem(Path(old), source)).with_suffix(suffix)
+    if old_export.is_file():
+        new_export = (target / output_stem(Path(new), source)).with_suffix(suffix)
+        new_export.parent.mkdir(parents=True, exist_ok=True)
+        old_export.replace(new_export)
 
 
 @click.command()
@@ -19,14 +145,132 @@ from .logger import Logger
 )
 @click.option("-w", "--write", "operation", flag_value="write", help="写入模式")
 @click.option("-c", "--clear", "operation", flag_value="clear", help="清除模式")
+@click.option("--sniff", "operation", flag_value="sniff", help="识别模式")
+@click.option("--stats", "operation", flag_value="stats", help="统计模式")
+@click.option("--index", "operation", flag_value="index", help="索引模式")
+@click.option("--search", "operation", flag_value="search", help="搜索模式")
+@click.option("--dedupe", "operation", flag_value="dedupe", help="去重模式")
+@click.option(
+    "--sweep", "operation", flag_value="sweep", help="参数扫描分组模式"
+)
+@click.option("--watch", "operation", flag_value="watch", help="监视模式")
+@click.option("--serve", "operation", flag_value="serve", help="服务模式")
+@click.option("--client", "operation", flag_value="client", help="客户端模式")
+@click.option("--http", "operation", flag_value="http", help="HTTP 服务模式")
 # Option
-@click.option("-i", "--input-path", type=str, help="输入路径", required=True)
+@click.option("-i", "--input-path", type=str, help="输入路径（服务模式下不需要）")
+@click.option(
+    "--from-stdin",
+    is_flag=True,
+    help="从标准输入读取文件路径，每行一个（代替 -i）",
+)
+@click.option(
+    "-0",
+    "--null",
+    "null_separated",
+    is_flag=True,
+    help="标准输入中的路径以 NUL 分隔（配合 find -print0 或 fd -0）",
+)
 @click.option("-o", "--output-path", type=str, help="输出路径")
 @click.option(
     "-f",
     "--format-type",
     default="TXT",
-    type=click.Choice(["TXT", "JSON"], case_sensitive=False),
+    type=click.Choice(["TXT", "JSON", "JSONL", "SQLITE"], case_sensitive=False),
+)
+@click.option(
+    "--compression",
+    type=click.Choice(["gzip", "zstd"], case_sensitive=False),
+    help="JSONL 输出的压缩格式（默认根据 .gz/.zst 后缀判断）",
+)
+@click.option(
+    "--fields",
+    type=str,
+    callback=parse_fields,
+    help="仅提取指定字段，以逗号分隔（如 tool,model,seed）",
+)
+@click.option(
+    "--manifest",
+    type=click.Path(dir_okay=False),
+    help="增量清单文件，再次运行时仅处理新增或修改的文件",
+)
+@click.option(
+    "--workers", default=1, type=click.IntRange(min=1), help="并行读取的线程数"
+)
+@click.option("--recursive", is_flag=True, help="递归读取子目录")
+@click.option(
+    "--include", multiple=True, help="仅处理匹配的文件（glob，可多次指定）"
+)
+@click.option(
+    "--exclude", multiple=True, help="跳过匹配的文件或目录（glob，可多次指定）"
+)
+@click.option(
+    "--max-depth",
+    type=click.IntRange(min=0),
+    help="子目录最大递归深度（指定后自动启用递归）",
+)
+@click.option(
+    "--walk-workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="并行遍历目录的线程数（适用于网络文件系统）",
+)
+@click.option(
+    "--debounce",
+    default=1.0,
+    type=click.FloatRange(min=0),
+    help="监视模式下，文件大小和修改时间保持不变多少秒后才读取",
+)
+@click.option(
+    "--poll", is_flag=True, help="监视模式下使用轮询而不是 inotify（适用于网络文件系统）"
+)
+@click.option("-q", "--query", type=str, help="搜索关键词")
+@click.option(
+    "--limit", default=20, type=click.IntRange(min=1), help="最多返回的搜索结果数"
+)
+@click.option(
+    "--top",
+    default=20,
+    type=click.IntRange(min=1),
+    help="统计模式下输出的高频提示词数量",
+)
+@click.option(
+    "--threshold",
+    default=0.8,
+    type=click.FloatRange(min=0, max=1),
+    help="去重模式下判定为相似提示词的 Jaccard 相似度阈值",
+)
+@click.option(
+    "--free",
+    "free_keys",
+    default="seed",
+    callback=lambda ctx, param, value: tuple(
+        key.strip() for key in value.split(",") if key.strip()
+    ),
+    help="参数扫描分组时允许不同的参数，以逗号分隔（默认 seed）",
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False),
+    help="服务的 Unix socket 路径（服务模式下默认使用标准输入输出）",
+)
+@click.option("--host", default="127.0.0.1", help="HTTP 服务监听的地址")
+@click.option(
+    "--port", default=8765, type=click.IntRange(0, 65535), help="HTTP 服务监听的端口"
+)
+@click.option(
+    "--profile", is_flag=True, help="结束时输出各阶段耗时和各工具的 p50/p95/p99"
+)
+@click.option(
+    "--profile-output",
+    type=click.Path(dir_okay=False),
+    help="另存性能数据：.json 为 Chrome trace，其他后缀为 cProfile 统计（隐含 --profile）",
+)
+@click.option(
+    "--metrics-output",
+    type=click.Path(dir_okay=False),
+    help="结束时保存指标：.json 为 JSON，其他后缀为 Prometheus 文本格式",
 )
 @click.option("-m", "--metadata", type=str, help="元数据文件")
 @click.option("-p", "--positive", type=str, help="正向提示词")
@@ -38,143 +282,527 @@ from .logger import Logger
     default="WARN",
     type=click.Choice(["DEBUG", "INFO", "WARN", "ERROR"], case_sensitive=False),
 )
+@click.option(
+    "--log-format",
+    default="text",
+    type=click.Choice(["text", "json"], case_sensitive=False),
+    help="日志格式，json 为每行一个 JSON 对象",
+)
 def cli(
     operation,
     input_path,
+    from_stdin,
+    null_separated,
     output_path,
     metadata,
     positive,
     negative,
     setting,
     format_type,
+    compression,
+    fields,
+    manifest,
+    workers,
+    recursive,
+    include,
+    exclude,
+    max_depth,
+    walk_workers,
+    debounce,
+    poll,
+    query,
+    limit,
+    top,
+    threshold,
+    free_keys,
+    socket_path,
+    host,
+    port,
+    profile,
+    profile_output,
+    metrics_output,
     log_level,
+    log_format,
 ):
 
     logger = Logger("SD_Prompt_Reader.Cli")
-    Logger.configure_global_logger(log_level)
-
-    # Ensure the input path exists
-    source = Path(input_path)
-    logger.debug(f"Input: {source}")
-    if not source.exists():
-        logger.error("输入路径不存在")
-        raise click.UsageError("指定的输入路径不存在。")
-    elif source.is_file():
-        logger.debug("输入为文件")
+    Logger.configure_global_logger(log_level, log_format.lower() == "json")
+
+    if operation == "serve":
+        from .rpc import Service, serve_stdio, serve_unix
+
+        logger.debug("服务模式")
+        service = Service(workers)
+        try:
+            if socket_path:
+                serve_unix(service, socket_path)
+            else:
+                # stdout carries the responses, logs go to stderr
+                serve_stdio(service)
+        except KeyboardInterrupt:
+            logger.info("服务已停止")
+        except OSError as e:
+            logger.error(f"服务启动失败：{e}")
+            raise click.UsageError(str(e))
+        return
+
+    if operation == "http":
+        from .http_server import serve_http
+
+        logger.debug("HTTP 服务模式")
+        try:
+            serve_http(host, port, workers)
+        except KeyboardInterrupt:
+            logger.info("服务已停止")
+        except OSError as e:
+            logger.error(f"服务启动失败：{e}")
+            raise click.UsageError(str(e))
+        return
+
+    if null_separated and not from_stdin:
+        raise click.UsageError("-0 只能与 --from-stdin 一起使用。")
+    if from_stdin:
+        if input_path is not None:
+            raise click.UsageError("-i 与 --from-stdin 不能同时使用。")
+        if operation not in STDIN_OPERATIONS:
+            raise click.UsageError("该模式不支持 --from-stdin。")
+    elif input_path is None:
+        raise click.UsageError("必须指定输入路径（-i）或 --from-stdin。")
+
+    from .remote import is_url
+
+    remote = not from_stdin and is_url(input_path)
+    if from_stdin:
+        logger.debug("从标准输入读取路径")
+        # only names the default output files, stdin.jsonl and stdin.db
+        source = Path("stdin")
+        # paths reach the workers as they arrive, the pipe is never
+        # listed up front
+        file_list = read_paths(
+            sys.stdin.buffer, b"\0" if null_separated else b"\n"
+        )
+    elif remote:
+        logger.debug(f"Input: {input_path}")
+        if operation != "read":
+            raise click.UsageError("只有读取模式支持 URL 输入。")
+        logger.debug("输入为 URL")
+        # named after the last part of its path for the default outputs
+        source = Path(urlsplit(input_path).path)
         file_list = [input_path]
     else:
-        logger.debug("输入为文件夹")
-        file_list = [
-            file
-            for file in source.glob("*")
-            if file.is_file() and file.suffix in SUPPORTED_FORMATS
-        ]
-        logger.debug(f"检测到文件数：{len(file_list)}")
+        # Ensure the input path exists
+        source = Path(input_path)
+        logger.debug(f"Input: {source}")
+        if not source.exists():
+            logger.error("输入路径不存在")
+            raise click.UsageError("指定的输入路径不存在。")
+        elif source.is_file():
+            logger.debug("输入为文件")
+            file_list = [input_path]
+        else:
+            logger.debug("输入为文件夹")
+            # files are yielded as they are found instead of listed up front
+            file_list = walk(
+                source,
+                recursive=recursive,
+                include=include,
+                exclude=exclude,
+                max_depth=max_depth,
+                workers=walk_workers,
+            )
+
+    profiler = None
+    stats_profiler = None
+    if profile or profile_output:
+        from . import timing
+
+        trace = bool(profile_output) and profile_output.lower().endswith(".json")
+        profiler = timing.enable(trace)
+        if profile_output and not trace:
+            import cProfile
+
+            if workers > 1:
+                logger.warning(
+                    "cProfile 只记录主线程，工作线程的调用请使用 --workers 1"
+                )
+            stats_profiler = cProfile.Profile()
+            stats_profiler.enable()
 
     match operation:
         case "read":
+            from .archive import is_archive, read_archive
+            from .database import Database, FIELDS as DATABASE_FIELDS
+            from .jsonl import JsonlWriter, compression_for, open_jsonl
+            from .manifest import Manifest
+            from .pipeline import read_files, SUCCESS_STATUS
+            from .timing import stage
+
             logger.debug("读取模式")
+            # an archive is read like a folder of its images
+            archive = (
+                not (from_stdin or remote) and source.is_file() and is_archive(source)
+            )
+            single = remote or (
+                not from_stdin and source.is_file() and not archive
+            )
+            if archive and (format_type == "SQLITE" or manifest):
+                raise click.UsageError("读取压缩包时不支持 SQLITE 格式和 --manifest。")
+            if remote and (format_type == "SQLITE" or manifest):
+                raise click.UsageError("读取 URL 时不支持 SQLITE 格式和 --manifest。")
+            target = Path(output_path) if output_path not in (None, "-") else None
+            if format_type == "JSONL":
+                # one stream for every image, stdout unless a path is given
+                if target and (target.is_dir() or not target.suffix):
+                    target.mkdir(parents=True, exist_ok=True)
+                    target = target / f"{source.stem}.jsonl"
+                compression = compression or compression_for(target)
+                if compression and target and not compression_for(target):
+                    target = target.with_name(
+                        target.name + {"gzip": ".gz", "zstd": ".zst"}[compression]
+                    )
+                if target:
+                    target.parent.mkdir(parents=True, exist_ok=True)
+            elif format_type == "SQLITE":
+                if not target:
+                    raise click.UsageError("SQLITE 格式需要指定输出数据库路径。")
+                if target.is_dir() or not target.suffix:
+                    target = target / f"{source.stem}.db"
+                target.parent.mkdir(parents=True, exist_ok=True)
+                # the columns are fixed, --fields does not apply
+                fields = DATABASE_FIELDS
+            elif (
+                target
+                and not single
+                and (target.is_file() or (not target.exists() and target.suffix))
+            ):
+                logger.error("输出路径为文件而不是目录")
+                raise click.UsageError(
+                    "当输入路径为目录时，输出路径必须为目录，不能是文件。"
+                )
+            # raw is only needed for printing a single file, TXT export or
+            # when it was asked for explicitly
+            if format_type in ("JSONL", "SQLITE"):
+                keep = ("raw",) if fields is not None and "raw" in fields else ()
+            elif single or format_type == "TXT":
+                keep = ("raw",)
+            else:
+                keep = ()
+            read_fields = fields | {"raw"} if fields is not None and keep else fields
+            total_count = 0
             success_count = 0
-            read_list = {}
-            failure_list = {}
-            for file in file_list:
-                logger.debug(f"读取文件：{file}")
-                with open(file, "rb") as f:
-                    image_data = ImageDataReader(f)
-                    if image_data.status.name == "READ_SUCCESS":
+            with ExitStack() as stack:
+                writer = None
+                if format_type == "JSONL":
+                    try:
+                        stream = stack.enter_context(open_jsonl(target, compression))
+                    except ImportError as e:
+                        logger.error(f"缺少依赖：{e}")
+                        raise click.UsageError("zstd 压缩需要安装 zstandard。")
+                    writer = JsonlWriter(
+                        stream,
+                        fields if fields is not None else PROPS_FIELDS,
+                    )
+                elif format_type == "SQLITE":
+                    writer = stack.enter_context(Database(target))
+                    # unchanged files are skipped before they are read
+                    file_list = writer.changed_files(file_list)
+                history = None
+                if manifest:
+                    history = stack.enter_context(Manifest(manifest))
+                    file_list = history.changed_files(
+                        file_list,
+                        on_rename=lambda old, new: rename_export(
+                            old, new, target, source, format_type, writer
+                        ),
+                    )
+                # discover -> read -> export: each result is written and
+                # released right away, only a bounded window is in flight
+                if archive:
+                    results = read_archive(
+                        source, workers, keep=keep, fields=read_fields
+                    )
+                else:
+                    results = read_files(
+                        file_list, workers, keep=keep, fields=read_fields
+                    )
+                for file, image_data in results:
+                    total_count += 1
+                    log_event(logger, logging.DEBUG, "读取文件", file=file)
+                    if format_type == "SQLITE":
+                        # failures are stored too, so reruns skip them
+                        writer.write(file, image_data)
+                    changed = history.record(file, image_data) if history else True
+                    if image_data.status in SUCCESS_STATUS:
                         logger.debug("读取成功")
                         success_count += 1
-                        if source.is_file():
+                        if not changed:
+                            logger.debug("读取结果未变化，跳过导出")
+                            continue
+                        if format_type == "JSONL":
+                            writer.write(file, image_data)
+                        if writer:
+                            continue
+                        if single:
                             click.echo(image_data.raw)
-                        read_list[file] = image_data
+                        if target:
+                            with stage("export"):
+                                export_result(
+                                    file,
+                                    image_data,
+                                    target,
+                                    source,
+                                    format_type,
+                                    fields,
+                                )
                     else:
-                        logger.warning(
-                            f"读取失败：{file}（原因：{image_data.status.name}）"
+                        log_event(
+                            logger,
+                            logging.WARNING,
+                            "读取失败",
+                            file=file,
+                            status=image_data.status.name,
                         )
-                        failure_list[file] = image_data.status.name
-            if source.is_dir():
-                logger.info(f"读取文件总数：{len(file_list)}")
+            if not single:
+                logger.info(f"读取文件总数：{total_count}")
                 logger.info(f"成功：{success_count}")
-                if failure_list:
-                    logger.info("失败列表：")
-                    for file, status in failure_list.items():
-                        logger.info(f"{file}: {status}")
+                logger.info(f"失败：{total_count - success_count}")
+            if history:
+                logger.info(f"未变化跳过：{history.skipped}")
+                logger.info(f"重命名：{history.renamed}")
 
+        case "sniff":
+            from .jsonl import compression_for, dump_record, open_jsonl
+            from .pipeline import bounded_map
+
+            logger.debug("识别模式")
+            target = Path(output_path) if output_path not in (None, "-") else None
+            if target:
+                target.parent.mkdir(parents=True, exist_ok=True)
+            compression = compression or compression_for(target)
+            tool_count = 0
+            total_count = 0
+            try:
+                stream = open_jsonl(target, compression)
+                with stream as f:
+                    for file, result in bounded_map(sniff_file, file_list, workers):
+                        total_count += 1
+                        tool_count += bool(result.tool)
+                        f.write(dump_record(file, result.to_dict()))
+                        f.write("\n")
+            except ImportError as e:
+                logger.error(f"缺少依赖：{e}")
+                raise click.UsageError("zstd 压缩需要安装 zstandard。")
+            logger.info(f"识别文件总数：{total_count}")
+            logger.info(f"包含元数据：{tool_count}")
+
+        case "stats":
+            from .stats import aggregate
+
+            logger.debug("统计模式")
+            stats = aggregate(file_list, workers)
+            data = json.dumps(stats.to_dict(top), indent=4, ensure_ascii=False)
             if output_path:
                 target = Path(output_path)
-                logger.debug(f"输出：{target}")
-                for file, image_data in read_list.items():
-                    logger.debug(f"导出文件：{file}")
-                    file_path = Path(file)
-                    if target.is_dir():
-                        logger.debug("输出目录已存在")
-                        folder = target
-                        stem = file_path.stem
-                    elif target.is_file():
-                        if source.is_dir():
-                            logger.error("输出路径为文件而不是目录")
-                            raise click.UsageError(
-                                "当输入路径为目录时，输出路径必须为目录，不能是文件。"
-                            )
-                        logger.debug("输出文件已存在，将覆盖旧文件")
-                        folder = target.parent
-                        stem = target.stem
-                        if not format_type:
-                            format_type = target.suffix.strip(".")
-                    else:
-                        if target.suffix:
-                            if source.is_dir():
-                                logger.error("输出路径为文件而不是目录")
-                                raise click.UsageError(
-                                    "当输入路径为目录时，输出路径必须为目录，不能是文件。"
-                                )
-                            logger.debug("输出文件不存在")
-                            logger.debug("将创建新文件")
-                            folder = target.parent
-                            stem = target.stem
-                            if not format_type:
-                                format_type = target.suffix.strip(".")
-                        else:
-                            logger.debug("输出目录不存在")
-                            logger.debug("将创建新目录")
-                            folder = target
-                            stem = file_path.stem
-                        folder.mkdir(parents=True, exist_ok=True)
-                    target_file_name = folder / stem
+                target.parent.mkdir(parents=True, exist_ok=True)
+                with open(target, "w", encoding="utf-8") as f:
+                    f.write(data)
+            else:
+                click.echo(data)
+            logger.info(f"统计文件总数：{stats.total}")
+
+        case "index":
+            from .database import FIELDS as DATABASE_FIELDS
+            from .pipeline import read_files
+            from .search import INDEX_FILE, SearchIndex
+
+            logger.debug("索引模式")
+            if not source.is_dir():
+                logger.error("输入为文件而不是目录")
+                raise click.UsageError("索引模式下，输入路径必须是目录。")
+            target = Path(output_path) if output_path else source / INDEX_FILE
+            target.parent.mkdir(parents=True, exist_ok=True)
+            total_count = 0
+            with SearchIndex(target) as index:
+                # only new or modified files are read
+                for file, image_data in read_files(
+                    index.changed_files(file_list), workers, fields=DATABASE_FIELDS
+                ):
+                    total_count += 1
+                    log_event(logger, logging.DEBUG, "索引文件", file=file)
+                    index.write(file, image_data)
+                removed_count = index.prune(source)
+            logger.info(f"索引：{target}")
+            logger.info(f"更新文件数：{total_count}")
+            logger.info(f"移除文件数：{removed_count}")
+
+        case "dedupe":
+            from .database import FIELDS as DATABASE_FIELDS
+            from .dedupe import SIGNATURE_FILE, SignatureStore
+            from .pipeline import read_files
+
+            logger.debug("去重模式")
+            if not source.is_dir():
+                logger.error("输入为文件而不是目录")
+                raise click.UsageError("去重模式下，输入路径必须是目录。")
+            target = Path(output_path) if output_path else source / SIGNATURE_FILE
+            target.parent.mkdir(parents=True, exist_ok=True)
+            total_count = 0
+            with SignatureStore(target) as store:
+                # signatures of unchanged files are reused from the store
+                for file, image_data in read_files(
+                    store.changed_files(file_list), workers, fields=DATABASE_FIELDS
+                ):
+                    total_count += 1
+                    log_event(logger, logging.DEBUG, "计算签名", file=file)
+                    store.write(file, image_data)
+                store.prune(source)
+                clusters = store.clusters(threshold)
+            for paths in clusters:
+                click.echo(
+                    json.dumps(
+                        {"size": len(paths), "files": paths}, ensure_ascii=False
+                    )
+                )
+            logger.info(f"更新文件数：{total_count}")
+            logger.info(f"相似分组数：{len(clusters)}")
+
+        case "sweep":
+            from .pipeline import read_files
+            from .sweep import FIELDS as SWEEP_FIELDS, SweepGrouper
+
+            logger.debug("参数扫描分组模式")
+            grouper = SweepGrouper(free_keys)
+            total_count = 0
+            for file, image_data in read_files(
+                file_list, workers, fields=SWEEP_FIELDS
+            ):
+                total_count += 1
+                grouper.add(file, image_data)
+            sweeps = grouper.sweeps()
+            for group in sweeps:
+                click.echo(json.dumps(group.to_dict(), ensure_ascii=False))
+            logger.info(f"读取文件总数：{total_count}")
+            logger.info(f"分组数：{len(sweeps)}")
+
+        case "search":
+            from .search import INDEX_FILE, SearchIndex
+
+            logger.debug("搜索模式")
+            if not query:
+                raise click.UsageError("搜索模式下，必须指定搜索关键词（-q）。")
+            index_path = source / INDEX_FILE if source.is_dir() else source
+            if not index_path.is_file():
+                logger.error("索引文件不存在")
+                raise click.UsageError("索引文件不存在，请先使用 --index 建立索引。")
+            with SearchIndex(index_path) as index:
+                results = index.search(query, limit)
+            logger.info(f"匹配数：{len(results)}")
+            for path, score in results:
+                log_event(logger, logging.DEBUG, "匹配", file=path, score=score)
+                click.echo(path)
+
+        case "watch":
+            from .database import FIELDS as DATABASE_FIELDS
+            from .jsonl import JsonlWriter, compression_for, open_jsonl
+            from .pipeline import read_files
+            from .search import INDEX_FILE, SearchIndex
+            from .watcher import watch
+
+            logger.debug("监视模式")
+            if not source.is_dir():
+                logger.error("输入为文件而不是目录")
+                raise click.UsageError("监视模式下，输入路径必须是目录。")
+            target = Path(output_path) if output_path not in (None, "-") else None
+            total_count = 0
+            with ExitStack() as stack:
+                if format_type == "SQLITE":
+                    # upserted into the search index, --search sees new images
+                    target = target or source / INDEX_FILE
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    writer = stack.enter_context(SearchIndex(target))
+                    read_fields = DATABASE_FIELDS
+                else:
+                    if target:
+                        target.parent.mkdir(parents=True, exist_ok=True)
+                    compression = compression or compression_for(target)
                     try:
-                        match format_type:
-                            case "TXT":
-                                logger.debug("输出格式：TXT")
-                                with open(
-                                    target_file_name.with_suffix(".txt"),
-                                    "w",
-                                    encoding="utf-8",
-                                ) as f:
-                                    f.write(image_data.raw)
-                                    logger.debug("导出成功")
-                            case "JSON":
-                                logger.debug("输出格式：JSON")
-                                with open(
-                                    target_file_name.with_suffix(".json"),
-                                    "w",
-                                    encoding="utf-8",
-                                ) as f:
-                                    parameter = {
-                                        "positive": image_data.positive,
-                                        "negative": image_data.negative,
-                                        "setting": image_data.setting,
-                                    }
-                                    parameter.update(image_data.parameter)
-                                    json.dump(parameter, f, indent=4)
-                                    logger.debug("导出成功")
-                            case _:
-                                logger.error(
-                                    f"不支持的输出格式：{format_type}（仅支持 TXT/JSON）"
-                                )
-                    except IOError as e:
-                        logger.error(f"保存失败：{e}")
+                        stream = stack.enter_context(open_jsonl(target, compression))
+                    except ImportError as e:
+                        logger.error(f"缺少依赖：{e}")
+                        raise click.UsageError("zstd 压缩需要安装 zstandard。")
+                    writer = JsonlWriter(
+                        stream, fields if fields is not None else PROPS_FIELDS
+                    )
+                    read_fields = writer.fields
+                keep = ("raw",) if "raw" in read_fields else ()
+                logger.info(f"开始监视：{source}")
+                try:
+                    for files in watch(
+                        source,
+                        recursive=recursive,
+                        include=include,
+                        exclude=exclude,
+                        max_depth=max_depth,
+                        debounce=debounce,
+                        poll=poll,
+                    ):
+                        for file, image_data in read_files(
+                            files, workers, keep=keep, fields=read_fields
+                        ):
+                            total_count += 1
+                            log_event(logger, logging.DEBUG, "读取文件", file=file)
+                            writer.write(file, image_data)
+                        # every batch is visible as soon as it is read
+                        if format_type == "SQLITE":
+                            writer.commit()
+                        else:
+                            stream.flush()
+                except KeyboardInterrupt:
+                    logger.info("监视已停止")
+            logger.info(f"读取文件总数：{total_count}")
+
+        case "client":
+            from .jsonl import dump_record
+            from .rpc import Client, RpcError
+
+            logger.debug("客户端模式")
+            if not socket_path:
+                raise click.UsageError(
+                    "客户端模式下，必须指定服务的 socket 路径（--socket）。"
+                )
+            total_count = 0
+            try:
+                with Client(socket_path) as client:
+                    # the server has its own working directory
+                    for record in client.batch(
+                        "read",
+                        (Path(file).resolve() for file in file_list),
+                        fields=sorted(fields) if fields is not None else None,
+                    ):
+                        total_count += 1
+                        if "error" in record:
+                            log_event(
+                                logger,
+                                logging.WARNING,
+                                "读取失败",
+                                file=record["file"],
+                                error=record["error"]["message"],
+                            )
+                            continue
+                        click.echo(dump_record(record.pop("file"), record))
+            except RpcError as e:
+                logger.error(f"请求失败：{e}")
+                raise click.UsageError(f"请求失败：{e}")
+            except OSError as e:
+                logger.error(f"无法连接服务：{e}")
+                raise click.UsageError(f"无法连接服务：{e}")
+            logger.info(f"读取文件总数：{total_count}")
 
         case "write" | "clear":
+            from .image_data_reader import ImageDataReader
+
+            file_list = list(file_list)
+            logger.debug(f"检测到文件数：{len(file_list)}")
             if operation == "write":
                 logger.debug("写入模式")
                 if source.is_dir():
@@ -209,14 +837,14 @@ def cli(
                 target = Path(output_path)
                 logger.debug(f"输出：{target}")
                 for file in file_list:
-                    logger.debug(f"处理文件：{file}")
+                    log_event(logger, logging.DEBUG, "处理文件", file=file)
                     file_path = Path(file)
                     if target.is_dir():
                         logger.debug("输出目录已存在")
                         folder = target
-                        stem = file_path.stem
+                        stem = output_stem(file_path, source)
                     elif target.is_file():
-                        if source.is_dir():
+                        if from_stdin or source.is_dir():
                             logger.error("输出路径为文件而不是目录")
                             raise click.UsageError(
                                 "当输入路径为目录时，输出路径必须为目录，不能是文件。"
@@ -226,7 +854,7 @@ def cli(
                         stem = target.stem
                     else:
                         if target.suffix:
-                            if source.is_dir():
+                            if from_stdin or source.is_dir():
                                 logger.error("输出路径为文件而不是目录")
                                 raise click.UsageError(
                                     "当输入路径为目录时，输出路径必须为目录，不能是文件。"
@@ -239,9 +867,10 @@ def cli(
                             logger.debug("输出目录不存在")
                             logger.debug("将创建新目录")
                             folder = target
-                            stem = file_path.stem
+                            stem = output_stem(file_path, source)
                         folder.mkdir(parents=True, exist_ok=True)
                     target_file_name = folder / stem
+                    target_file_name.parent.mkdir(parents=True, exist_ok=True)
                     destination = target_file_name.with_suffix(file_path.suffix)
                     if file_path.resolve(strict=False) == destination.resolve(strict=False):
                         if not target.suffix:
@@ -294,6 +923,28 @@ def cli(
                 logger.info(f"处理文件总数：{len(file_list)}")
                 logger.info(f"成功：{success_count}")
 
+    if profiler:
+        timing.disable()
+        if stats_profiler:
+            stats_profiler.disable()
+            stats_profiler.dump_stats(profile_output)
+        elif profile_output:
+            profiler.write_trace(profile_output)
+        # stdout may carry JSONL, the report goes to stderr
+        click.echo(profiler.format_report(), err=True)
+
+    if metrics_output:
+        from .metrics import registry
+
+        target = Path(metrics_output)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(target, "w", encoding="utf-8") as f:
+            if target.suffix.lower() == ".json":
+                f.write(registry.to_json())
+            else:
+                f.write(registry.to_prometheus())
+        logger.info(f"指标：{target}")
+
 
 if __name__ == "__main__":
     cli()
@@ -3,11 +3,11 @@ __filename__ = "constants.py"
 __copyright__ = "Copyright 2023"
 __email__ = "receyuki@gmail.com"
 
-from importlib import resources
 from pathlib import Path
 from . import resources as res
 
-RESOURCE_DIR = str(resources.files(res))
+# the package directory, importlib.resources costs more than the CLI startup
+RESOURCE_DIR = res.__path__[0]
 SUPPORTED_FORMATS = [".png", ".jpg", ".jpeg", ".webp"]
 COLOR_THEME = Path(RESOURCE_DIR, "gray.json")
 INFO_FILE = Path(RESOURCE_DIR, "info_24.png")
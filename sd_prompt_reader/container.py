@@ -0,0 +1,324 @@
+__author__ = "receyuki"
+__filename__ = "container.py"
+__copyright__ = "Copyright 2024"
+__email__ = "receyuki@gmail.com"
+
+# Header-only scanners for PNG chunks, JPEG segments and WebP RIFF chunks.
+# They work on any object supporting the buffer protocol (bytes, memoryview,
+# mmap) and only touch the bytes of the chunks they read, so pixel data is
+# skipped by offset and never decoded.
+
+import mmap
+import os
+import struct
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_SIGNATURE = b"\xff\xd8"
+# same guard as Pillow's MAX_TEXT_MEMORY against decompression bombs
+MAX_TEXT_MEMORY = 64 * 1024 * 1024
+PNG_MODES = {0: "L", 2: "RGB", 3: "P", 4: "LA", 6: "RGBA"}
+EXIF_MODEL = 0x0110
+# longest PNG keyword plus its separator
+KEYWORD_BYTES = 80
+
+
+@dataclass(slots=True)
+class Container:
+    format: str
+    width: int = 0
+    height: int = 0
+    mode: str = ""
+    info: dict = field(default_factory=dict)
+    # bytes of the text, exif and xmp chunks or segments
+    metadata_size: int = 0
+    # bytes of the whole buffer, the file size when scanned from a file
+    size: int = 0
+
+
+@contextmanager
+def mapped(path):
+    """Map a file read-only so scanners only fault in the pages they touch."""
+    with open(path, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            # chunks are visited by offset, readahead would pull in pixels
+            if hasattr(buffer, "madvise") and hasattr(mmap, "MADV_RANDOM"):
+                buffer.madvise(mmap.MADV_RANDOM)
+            yield buffer
+
+
+def scan_file(path, **kwargs) -> Container | None:
+    with mapped(path) as buffer:
+        return scan(buffer, **kwargs)
+
+
+def scan(buffer, inflate: bool = True, limit: int = None) -> Container | None:
+    """Scan the metadata of a PNG, JPEG or WebP buffer, None if unknown.
+
+    With inflate False compressed text is not decompressed, and with a
+    limit the content of chunks ending past limit bytes is not read; in
+    both cases the key is kept with an empty value.
+    """
+    view = memoryview(buffer)
+    container = None
+    try:
+        if view[:8] == PNG_SIGNATURE:
+            container = scan_png(view, inflate, limit)
+        elif view[:2] == JPEG_SIGNATURE:
+            container = scan_jpeg(view, limit)
+        elif view[:4] == b"RIFF" and view[8:12] == b"WEBP":
+            container = scan_webp(view, limit)
+    except (struct.error, IndexError, ValueError, zlib.error):
+        # truncated or malformed, leave it to Pillow
+        return None
+    finally:
+        size = view.nbytes
+        view.release()
+    if container is not None:
+        container.size = size
+    return container
+
+
+def scan_png(view: memoryview, inflate: bool = True, limit: int = None) -> Container:
+    container = Container("PNG")
+    info = container.info
+    offset = 8
+    end = len(view)
+    while offset + 8 <= end:
+        length, chunk_type = struct.unpack_from(">I4s", view, offset)
+        start = offset + 8
+        # skip IDAT and other pixel chunks by offset, crc included
+        offset = start + length + 4
+        if offset > end:
+            break
+        if chunk_type in (b"tEXt", b"zTXt", b"iTXt", b"eXIf"):
+            container.metadata_size += length
+            skipped = limit is not None and start + length > limit
+            if chunk_type == b"eXIf":
+                if skipped:
+                    continue
+            elif skipped or (
+                not inflate and _compressed(chunk_type, view, start, length)
+            ):
+                # only the keyword is read
+                key, _, _ = bytes(
+                    view[start : start + min(length, KEYWORD_BYTES)]
+                ).partition(b"\0")
+                info[key.decode("latin-1")] = ""
+                continue
+        match chunk_type:
+            case b"IHDR":
+                width, height, _, color_type = struct.unpack_from(
+                    ">IIBB", view, start
+                )
+                container.width = width
+                container.height = height
+                container.mode = PNG_MODES.get(color_type, "")
+            case b"tEXt":
+                key, _, value = bytes(view[start : start + length]).partition(b"\0")
+                info[key.decode("latin-1")] = value.decode("latin-1", "replace")
+            case b"zTXt":
+                key, _, value = bytes(view[start : start + length]).partition(b"\0")
+                # value[0] is the compression method, always zlib
+                info[key.decode("latin-1")] = _inflate(value[1:]).decode(
+                    "latin-1", "replace"
+                )
+            case b"iTXt":
+                key, value = _itxt(view[start : start + length])
+                info[key] = value
+            case b"eXIf":
+                info["exif"] = b"Exif\x00\x00" + bytes(view[start : start + length])
+            case b"IEND":
+                break
+    return container
+
+
+def _compressed(chunk_type: bytes, view: memoryview, start: int, length: int):
+    if chunk_type == b"zTXt":
+        return True
+    if chunk_type == b"iTXt":
+        # the compression flag follows the keyword's separator
+        keyword = bytes(view[start : start + min(length, KEYWORD_BYTES)])
+        separator = keyword.find(b"\0")
+        return separator >= 0 and keyword[separator + 1 : separator + 2] == b"\1"
+    return False
+
+
+def _itxt(chunk: memoryview):
+    key, _, rest = bytes(chunk).partition(b"\0")
+    compressed, rest = rest[0], rest[2:]
+    _, _, rest = rest.partition(b"\0")  # language tag
+    _, _, text = rest.partition(b"\0")  # translated keyword
+    if compressed:
+        text = _inflate(text)
+    return key.decode("latin-1"), text.decode("utf-8", "replace")
+
+
+def _inflate(data: bytes) -> bytes:
+    decompressor = zlib.decompressobj()
+    text = decompressor.decompress(data, MAX_TEXT_MEMORY)
+    if decompressor.unconsumed_tail:
+        raise ValueError("Decompressed data too large")
+    return text
+
+
+def scan_jpeg(view: memoryview, limit: int = None) -> Container:
+    container = Container("JPEG", mode="RGB")
+    info = container.info
+    offset = 2
+    end = len(view)
+    while offset + 4 <= end:
+        if view[offset] != 0xFF:
+            break
+        marker = view[offset + 1]
+        # fill bytes and standalone markers carry no length
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        # start of scan, entropy coded data follows
+        if marker in (0xD9, 0xDA):
+            break
+        (length,) = struct.unpack_from(">H", view, offset + 2)
+        start = offset + 4
+        offset += 2 + length
+        segment = view[start : min(offset, end)]
+        if marker in (0xE1, 0xFE):
+            container.metadata_size += len(segment)
+            if limit is not None and offset > limit:
+                continue
+        if marker == 0xE1 and segment[:6] == b"Exif\x00\x00":
+            info.setdefault("exif", bytes(segment))
+        elif marker == 0xFE:
+            info["comment"] = bytes(segment)
+        elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack_from(">HH", segment, 1)
+            container.width = width
+            container.height = height
+            if segment[5] == 1:
+                container.mode = "L"
+            elif segment[5] == 4:
+                container.mode = "CMYK"
+    return container
+
+
+def scan_webp(view: memoryview, limit: int = None) -> Container:
+    container = Container("WEBP", mode="RGB")
+    info = container.info
+    offset = 12
+    end = len(view)
+    while offset + 8 <= end:
+        fourcc, length = struct.unpack_from("<4sI", view, offset)
+        start = offset + 8
+        # chunks are padded to an even size
+        offset = start + length + (length & 1)
+        chunk = view[start : min(start + length, end)]
+        if fourcc in (b"EXIF", b"XMP "):
+            container.metadata_size += len(chunk)
+            if limit is not None and start + length > limit:
+                continue
+        match fourcc:
+            case b"VP8X":
+                if chunk[0] & 0x10:
+                    container.mode = "RGBA"
+                container.width = int.from_bytes(chunk[4:7], "little") + 1
+                container.height = int.from_bytes(chunk[7:10], "little") + 1
+            case b"VP8L" if not container.width:
+                (bits,) = struct.unpack_from("<I", chunk, 1)
+                container.width = (bits & 0x3FFF) + 1
+                container.height = ((bits >> 14) & 0x3FFF) + 1
+                if bits >> 28 & 1:
+                    container.mode = "RGBA"
+            case b"VP8 " if not container.width:
+                width, height = struct.unpack_from("<HH", chunk, 6)
+                container.width = width & 0x3FFF
+                container.height = height & 0x3FFF
+            case b"EXIF":
+                info["exif"] = bytes(chunk)
+            case b"XMP ":
+                info["xmp"] = bytes(chunk)
+    return container
+
+
+def pixels_start(buffer) -> int | None:
+    """Offset of the first PNG IDAT chunk or JPEG scan, if within buffer.
+
+    Metadata before it is complete once the buffer reaches it, so a stream
+    can stop there. None for other formats, or when not reached yet.
+    """
+    view = memoryview(buffer)
+    try:
+        end = len(view)
+        if view[:8] == PNG_SIGNATURE:
+            offset = 8
+            while offset + 8 <= end:
+                length, chunk_type = struct.unpack_from(">I4s", view, offset)
+                if chunk_type == b"IDAT":
+                    return offset
+                offset += length + 12
+        elif view[:2] == JPEG_SIGNATURE:
+            offset = 2
+            while offset + 4 <= end and view[offset] == 0xFF:
+                marker = view[offset + 1]
+                # start of scan, or an image without one
+                if marker in (0xD9, 0xDA):
+                    return offset
+                if marker == 0xFF:
+                    offset += 1
+                elif marker == 0x01 or 0xD0 <= marker <= 0xD7:
+                    offset += 2
+                else:
+                    (length,) = struct.unpack_from(">H", view, offset + 2)
+                    offset += 2 + length
+        return None
+    finally:
+        view.release()
+
+
+def exif_tag(container: Container, tag: int = EXIF_MODEL):
+    """Read an IFD0 tag from the container's EXIF, like Image.getexif()."""
+    exif = container.info.get("exif")
+    if not exif and "Raw profile type exif" in container.info:
+        # ImageMagick style hex encoded exif in a PNG text chunk
+        exif = bytes.fromhex(
+            "".join(container.info["Raw profile type exif"].split("\n")[3:])
+        )
+    if not exif:
+        return None
+    if exif[:6] == b"Exif\x00\x00":
+        exif = exif[6:]
+    try:
+        return _ifd0_tag(exif, tag)
+    except (struct.error, ValueError):
+        return None
+
+
+def _ifd0_tag(tiff: bytes, tag: int):
+    order = {b"II": "<", b"MM": ">"}.get(tiff[:2])
+    if order is None:
+        return None
+    (ifd_offset,) = struct.unpack_from(order + "I", tiff, 4)
+    (count,) = struct.unpack_from(order + "H", tiff, ifd_offset)
+    for i in range(count):
+        entry_tag, entry_type, length, value = struct.unpack_from(
+            order + "HHI4s", tiff, ifd_offset + 2 + i * 12
+        )
+        if entry_tag != tag:
+            continue
+        # only ASCII and UNDEFINED values are of interest here
+        if entry_type not in (2, 7):
+            return None
+        if length > 4:
+            (value_offset,) = struct.unpack(order + "I", value)
+            value = tiff[value_offset : value_offset + length]
+        else:
+            value = value[:length]
+        return value.rstrip(b"\0")
+    return None
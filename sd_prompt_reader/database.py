@@ -0,0 +1,251 @@
+__author__ = "receyuki"
+__filename__ = "database.py"
+__copyright__ = "Copyright 2024"
+__email__ = "receyuki@gmail.com"
+
+import json
+import logging
+import os
+import sqlite3
+
+from .logger import Logger, log_event
+from .result import ParseResult
+from .timing import stage
+
+# rows written per transaction
+BATCH_SIZE = 500
+# what is read for each image, the parameter keys are the image columns
+FIELDS = frozenset(
+    {
+        "tool",
+        "status",
+        "format",
+        "width",
+        "height",
+        "model",
+        "sampler",
+        "seed",
+        "cfg",
+        "steps",
+        "positive",
+        "negative",
+        "positive_sdxl",
+        "negative_sdxl",
+        "setting",
+    }
+)
+
+logger = Logger("SD_Prompt_Reader.Database")
+
+# column affinities turn numeric strings into numbers, anything else is kept
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    tool TEXT,
+    status TEXT NOT NULL,
+    format TEXT,
+    width INTEGER,
+    height INTEGER,
+    model TEXT,
+    sampler TEXT,
+    seed INTEGER,
+    cfg REAL,
+    steps INTEGER
+);
+CREATE TABLE IF NOT EXISTS prompts (
+    path TEXT PRIMARY KEY REFERENCES images (path) ON DELETE CASCADE,
+    positive TEXT,
+    negative TEXT,
+    positive_sdxl TEXT,
+    negative_sdxl TEXT,
+    setting TEXT
+);
+CREATE INDEX IF NOT EXISTS images_tool ON images (tool);
+CREATE INDEX IF NOT EXISTS images_model ON images (model);
+"""
+
+UPSERT_IMAGE = """
+INSERT INTO images (
+    path, size, mtime, tool, status, format, width, height,
+    model, sampler, seed, cfg, steps
+)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (path) DO UPDATE SET
+    size = excluded.size,
+    mtime = excluded.mtime,
+    tool = excluded.tool,
+    status = excluded.status,
+    format = excluded.format,
+    width = excluded.width,
+    height = excluded.height,
+    model = excluded.model,
+    sampler = excluded.sampler,
+    seed = excluded.seed,
+    cfg = excluded.cfg,
+    steps = excluded.steps
+"""
+
+UPSERT_PROMPT = """
+INSERT INTO prompts (
+    path, positive, negative, positive_sdxl, negative_sdxl, setting
+)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (path) DO UPDATE SET
+    positive = excluded.positive,
+    negative = excluded.negative,
+    positive_sdxl = excluded.positive_sdxl,
+    negative_sdxl = excluded.negative_sdxl,
+    setting = excluded.setting
+"""
+
+
+class Database:
+    """SQLite export target, upserting one row per image path.
+
+    Files whose size and mtime match the stored row are skipped by
+    changed(), so a rerun only reads what was added or modified. Every
+    path passed to changed() is remembered for prune().
+    """
+
+    def __init__(self, path, batch_size: int = BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.count = 0
+        self._stats = {}
+        self._connection = sqlite3.connect(path, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.execute("PRAGMA foreign_keys = ON")
+        self._connection.executescript(SCHEMA)
+        self._connection.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS seen (path TEXT PRIMARY KEY)"
+        )
+        self._pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._connection is None:
+            return
+        self.commit()
+        self._connection.close()
+        self._connection = None
+
+    def commit(self):
+        if self._pending:
+            self._connection.execute("COMMIT")
+            self._pending = 0
+
+    def changed(self, file) -> bool:
+        """Whether the file is new or differs from its stored size and mtime."""
+        path = os.path.abspath(file)
+        self._connection.execute("INSERT OR IGNORE INTO seen VALUES (?)", (path,))
+        try:
+            stat = os.stat(file)
+        except OSError:
+            # let the reader report it
+            return True
+        row = self._connection.execute(
+            "SELECT size, mtime FROM images WHERE path = ?", (path,)
+        ).fetchone()
+        if row == (stat.st_size, stat.st_mtime_ns):
+            return False
+        self._stats[path] = stat
+        return True
+
+    def changed_files(self, files):
+        return (file for file in files if self.changed(file))
+
+    def prune(self, root) -> int:
+        """Drop images under root that were not passed to changed()."""
+        self.commit()
+        prefix = os.path.join(os.path.abspath(root), "")
+        docs = [
+            doc
+            for (doc,) in self._connection.execute(
+                "SELECT rowid FROM images "
+                "WHERE substr(path, 1, ?) = ? AND path NOT IN (SELECT path FROM seen)",
+                (len(prefix), prefix),
+            )
+        ]
+        if not docs:
+            return 0
+        self._connection.execute("BEGIN")
+        self._forget(docs)
+        # prompts and other tables keyed by path follow by cascade
+        self._connection.executemany(
+            "DELETE FROM images WHERE rowid = ?", ((doc,) for doc in docs)
+        )
+        self._connection.execute("COMMIT")
+        return len(docs)
+
+    def _forget(self, docs: list):
+        """Hook for data keyed by image rowid, called before rows are pruned."""
+
+    def write(self, file, result: ParseResult) -> bool:
+        """Upsert the row of a file, False if it is gone and was skipped."""
+        path = os.path.abspath(file)
+        stat = self._stats.pop(path, None)
+        if stat is None:
+            try:
+                stat = os.stat(file)
+            except OSError as e:
+                # missing, or deleted after it was read, so it has no row
+                log_event(logger, logging.WARNING, "跳过文件", file=file, error=e)
+                return False
+        with stage("export"):
+            if not self._pending:
+                self._connection.execute("BEGIN")
+            self._upsert(path, stat, result)
+            self.count += 1
+            self._pending += 1
+            if self._pending >= self.batch_size:
+                self.commit()
+        return True
+
+    def _upsert(self, path: str, stat: os.stat_result, result: ParseResult):
+        parameter = result.parameter
+        self._connection.execute(
+            UPSERT_IMAGE,
+            (
+                path,
+                stat.st_size,
+                stat.st_mtime_ns,
+                result.tool or None,
+                result.status.name,
+                result.format or None,
+                _value(result.width),
+                _value(result.height),
+                _value(parameter.get("model")),
+                _value(parameter.get("sampler")),
+                _value(parameter.get("seed")),
+                _value(parameter.get("cfg")),
+                _value(parameter.get("steps")),
+            ),
+        )
+        self._connection.execute(
+            UPSERT_PROMPT,
+            (
+                path,
+                result.positive or None,
+                result.negative or None,
+                json.dumps(result.positive_sdxl) if result.positive_sdxl else None,
+                json.dumps(result.negative_sdxl) if result.negative_sdxl else None,
+                result.setting or None,
+            ),
+        )
+
+
+def _value(value):
+    # unread images carry the GUI's blank placeholder
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    if isinstance(value, (str, int, float)):
+        return value
+    return str(value)
@@ -0,0 +1,200 @@
+__author__ = "receyuki"
+__filename__ = "dedupe.py"
+__copyright__ = "Copyright 2024"
+__email__ = "receyuki@gmail.com"
+
+import hashlib
+import os
+import random
+import zlib
+from array import array
+from functools import lru_cache
+from itertools import combinations
+
+from .database import BATCH_SIZE, Database
+from .result import ParseResult
+from .search import MAX_VARIABLES, tokenize
+
+# default signature store inside the scanned folder
+SIGNATURE_FILE = ".sd_prompt_reader.signatures.db"
+NUM_PERM = 128
+# with 32 bands of 4 rows, pairs above a Jaccard similarity of about 0.4
+# are likely to share a bucket; the threshold is applied when verifying
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+THRESHOLD = 0.8
+# buckets with more distinct signatures are verified against one member
+MAX_PAIRWISE = 64
+# signatures kept in memory while clustering, a document is in many buckets
+CACHE_SIZE = 65536
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+# fixed seed, stored signatures must stay comparable across runs
+_random = random.Random(1)
+PERMUTATIONS = [
+    (_random.randrange(1, MERSENNE_PRIME), _random.randrange(0, MERSENNE_PRIME))
+    for _ in range(NUM_PERM)
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS signatures (
+    doc INTEGER PRIMARY KEY,
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bands (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    doc INTEGER NOT NULL,
+    PRIMARY KEY (band, bucket, doc)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS bands_doc ON bands (doc);
+"""
+
+
+def shingles(prompt: str) -> set[str]:
+    """Words and word pairs, so both tag lists and sentences compare well."""
+    words = tokenize(prompt)
+    return set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+
+def minhash(tokens: set[str]) -> array | None:
+    if not tokens:
+        return None
+    hashes = [zlib.crc32(token.encode()) for token in tokens]
+    return array(
+        "I",
+        (
+            min(((a * h + b) % MERSENNE_PRIME) & MAX_HASH for h in hashes)
+            for a, b in PERMUTATIONS
+        ),
+    )
+
+
+def similarity(first: array, second: array) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(x == y for x, y in zip(first, second)) / len(first)
+
+
+def band_buckets(signature: array):
+    data = signature.tobytes()
+    width = ROWS * signature.itemsize
+    for band in range(BANDS):
+        digest = hashlib.blake2b(
+            data[band * width : (band + 1) * width], digest_size=8
+        ).digest()
+        yield band, int.from_bytes(digest, "little", signed=True)
+
+
+class SignatureStore(Database):
+    """MinHash signatures of positive prompts with their LSH band buckets.
+
+    Built on the SQLite export, so like it a rerun only reads new or
+    modified files, and buckets are grouped by SQLite rather than in memory.
+    """
+
+    def __init__(self, path, batch_size: int = BATCH_SIZE):
+        super().__init__(path, batch_size)
+        self._connection.executescript(SCHEMA)
+
+    def _upsert(self, path: str, stat: os.stat_result, result: ParseResult):
+        super()._upsert(path, stat, result)
+        (doc,) = self._connection.execute(
+            "SELECT rowid FROM images WHERE path = ?", (path,)
+        ).fetchone()
+        self._forget([doc])
+        signature = minhash(
+            shingles(
+                result.positive or " ".join(map(str, result.positive_sdxl.values()))
+            )
+        )
+        if signature is None:
+            return
+        self._connection.execute(
+            "INSERT INTO signatures VALUES (?, ?)", (doc, signature.tobytes())
+        )
+        self._connection.executemany(
+            "INSERT INTO bands VALUES (?, ?, ?)",
+            ((band, bucket, doc) for band, bucket in band_buckets(signature)),
+        )
+
+    def _forget(self, docs: list):
+        for doc in docs:
+            self._connection.execute("DELETE FROM signatures WHERE doc = ?", (doc,))
+            self._connection.execute("DELETE FROM bands WHERE doc = ?", (doc,))
+
+    def _load_signature(self, doc: int) -> array:
+        signature = array("I")
+        signature.frombytes(
+            self._connection.execute(
+                "SELECT signature FROM signatures WHERE doc = ?", (doc,)
+            ).fetchone()[0]
+        )
+        return signature
+
+    def clusters(self, threshold: float = THRESHOLD) -> list[list[str]]:
+        """Groups of paths whose prompts are at least threshold similar.
+
+        Only documents sharing a band bucket are compared, and a document
+        joins a cluster when it is similar to any of its members.
+        """
+        self.commit()
+        parent = {}
+        signature_of = lru_cache(maxsize=CACHE_SIZE)(self._load_signature)
+
+        def find(doc):
+            parent.setdefault(doc, doc)
+            while parent[doc] != doc:
+                parent[doc] = parent[parent[doc]]
+                doc = parent[doc]
+            return doc
+
+        def union(first, second):
+            parent[find(first)] = find(second)
+
+        buckets = self._connection.execute(
+            "SELECT group_concat(doc) FROM bands "
+            "GROUP BY band, bucket HAVING count(*) > 1"
+        ).fetchall()
+        for (docs,) in buckets:
+            docs = [int(doc) for doc in docs.split(",")]
+            # identical signatures need no comparison
+            distinct = {}
+            for doc in docs:
+                signature = signature_of(doc)
+                key = signature.tobytes()
+                if key in distinct:
+                    union(doc, distinct[key][0])
+                else:
+                    distinct[key] = (doc, signature)
+            members = list(distinct.values())
+            if len(members) > MAX_PAIRWISE:
+                pairs = ((members[0], member) for member in members[1:])
+            else:
+                pairs = combinations(members, 2)
+            for (first, first_signature), (second, second_signature) in pairs:
+                if find(first) == find(second):
+                    continue
+                if similarity(first_signature, second_signature) >= threshold:
+                    union(first, second)
+        groups = {}
+        for doc in parent:
+            groups.setdefault(find(doc), []).append(doc)
+        clusters = []
+        for docs in groups.values():
+            if len(docs) < 2:
+                continue
+            paths = []
+            for i in range(0, len(docs), MAX_VARIABLES):
+                chunk = docs[i : i + MAX_VARIABLES]
+                paths.extend(
+                    path
+                    for (path,) in self._connection.execute(
+                        "SELECT path FROM images "
+                        f"WHERE rowid IN ({', '.join('?' * len(chunk))})",
+                        chunk,
+                    )
+                )
+            clusters.append(sorted(paths))
+        clusters.sort(key=lambda paths: (-len(paths), paths[0]))
+        return clusters
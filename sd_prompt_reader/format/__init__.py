@@ -3,12 +3,29 @@ __filename__ = "__init__.py"
 __copyright__ = "Copyright 2023"
 __email__ = "receyuki@gmail.com"
 
+from importlib import import_module
+
 from .base_format import BaseFormat
-from .a1111 import A1111
-from .easydiffusion import EasyDiffusion
-from .invokeai import InvokeAI
-from .novelai import NovelAI
-from .comfyui import ComfyUI
-from .drawthings import DrawThings
-from .swarmui import SwarmUI
-from .fooocus import Fooocus
+
+# parsers are imported on first access, importing BaseFormat alone (as the
+# result and pipeline modules do) does not load every format
+_PARSERS = {
+    "A1111": ".a1111",
+    "EasyDiffusion": ".easydiffusion",
+    "InvokeAI": ".invokeai",
+    "NovelAI": ".novelai",
+    "ComfyUI": ".comfyui",
+    "DrawThings": ".drawthings",
+    "SwarmUI": ".swarmui",
+    "Fooocus": ".fooocus",
+}
+
+__all__ = ["BaseFormat", *_PARSERS]
+
+
+def __getattr__(name):
+    if name in _PARSERS:
+        parser = getattr(import_module(_PARSERS[name], __name__), name)
+        globals()[name] = parser
+        return parser
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -6,7 +6,7 @@ __email__ = "receyuki@gmail.com"
 import re
 
 from ..format.base_format import BaseFormat
-from ..utility import add_quotes, concat_strings
+from ..string_utility import add_quotes, concat_strings
 
 
 class A1111(BaseFormat):
@@ -66,20 +66,21 @@ class A1111(BaseFormat):
         elif steps_index == -1:
             self._positive = self._raw
 
-        # match parameters like "Steps: x",
-        pattern = r"\s*([^:,]+):\s*([^,]+)"
-        matches = re.findall(pattern, self._setting)
-        setting_dict = {}
-        for key, value in matches:
-            if key not in setting_dict:
-                setting_dict[key] = value
+        if self._wants(*self.PARAMETER_KEY, "width", "height"):
+            # match parameters like "Steps: x",
+            pattern = r"\s*([^:,]+):\s*([^,]+)"
+            matches = re.findall(pattern, self._setting)
+            setting_dict = {}
+            for key, value in matches:
+                if key not in setting_dict:
+                    setting_dict[key] = value
 
-        [self._width, self._height] = setting_dict.get("Size", "0x0").split("x")
+            [self._width, self._height] = setting_dict.get("Size", "0x0").split("x")
 
-        for p, s in zip(super().PARAMETER_KEY, A1111.SETTING_KEY):
-            self._parameter[p] = setting_dict.get(s)
+            for p, s in zip(super().PARAMETER_KEY, A1111.SETTING_KEY):
+                self._parameter[p] = setting_dict.get(s)
 
-        if self._extra:
+        if self._extra and self._wants("raw", "setting"):
             self._raw = concat_strings(self._raw, self._extra)
             self._setting = concat_strings(self._setting, self._extra)
 
@@ -26,9 +26,11 @@ class BaseFormat:
         self._parameter = dict.fromkeys(BaseFormat.PARAMETER_KEY, "")
         self._is_sdxl = False
         self._status = self.Status.UNREAD
+        self._fields = None
         self._logger = Logger("SD_Prompt_Reader.Parser")
 
-    def parse(self):
+    def parse(self, fields: frozenset = None):
+        self._fields = fields
         try:
             self._process()
         except Exception as e:
@@ -42,6 +44,10 @@ class BaseFormat:
     def _process(self):
         pass
 
+    def _wants(self, *fields):
+        # field projection: skip work that no requested field depends on
+        return self._fields is None or not self._fields.isdisjoint(fields)
+
     @property
     def height(self):
         return self._height
@@ -110,3 +116,4 @@ class BaseFormat:
         READ_SUCCESS = 2
         FORMAT_ERROR = 3
         COMFYUI_ERROR = 4
+        DETECTED = 5
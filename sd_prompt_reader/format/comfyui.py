@@ -6,7 +6,8 @@ __email__ = "receyuki@gmail.com"
 import json
 
 from ..format.base_format import BaseFormat
-from ..utility import remove_quotes, merge_dict
+from ..string_utility import remove_quotes, merge_dict
+from ..timing import stage
 
 
 class ComfyUI(BaseFormat):
@@ -42,7 +43,8 @@ class ComfyUI(BaseFormat):
         self._prompt = ""
         self._workflow = ""
 
-    def parse(self):
+    def parse(self, fields: frozenset = None):
+        self._fields = fields
         try:
             self._process()
         except Exception as e:
@@ -55,7 +57,8 @@ class ComfyUI(BaseFormat):
             self._setting = ""
             self._parameter = dict.fromkeys(BaseFormat.PARAMETER_KEY, "")
             self._is_sdxl = False
-            self._raw = "\n".join([self._prompt, self._workflow])
+            if self._wants("raw"):
+                self._raw = "\n".join([self._prompt, self._workflow])
             return self._status
         else:
             self._status = self.Status.READ_SUCCESS
@@ -73,7 +76,8 @@ class ComfyUI(BaseFormat):
         if isinstance(self._prompt, (dict, list)):
             prompt_json = self._prompt
         else:
-            prompt_json = json.loads(str(self._prompt))
+            with stage("json"):
+                prompt_json = json.loads(str(self._prompt))
 
         # find end node of each flow
         end_nodes = list(
@@ -88,13 +92,52 @@ class ComfyUI(BaseFormat):
         longest_flow_len = 0
 
         # traverse each flow from the end
-        for end_node in end_nodes:
-            flow, nodes = self._comfy_traverse(prompt_json, str(end_node[0]))
-            if len(nodes) > longest_flow_len:
-                longest_flow = flow
-                longest_nodes = nodes
-                longest_flow_len = len(nodes)
+        with stage("graph"):
+            for end_node in end_nodes:
+                flow, nodes = self._comfy_traverse(prompt_json, str(end_node[0]))
+                if len(nodes) > longest_flow_len:
+                    longest_flow = flow
+                    longest_nodes = nodes
+                    longest_flow_len = len(nodes)
 
+        if self._wants("raw"):
+            self._comfy_raw()
+
+        if self._wants("setting"):
+            self._comfy_setting(longest_flow)
+
+        for p, s in zip(super().PARAMETER_KEY, ComfyUI.SETTING_KEY):
+            match p:
+                case k if k in ("model", "sampler"):
+                    self._parameter[p] = str(remove_quotes(longest_flow.get(s)))
+                case "seed":
+                    self._parameter[p] = (
+                        str(longest_flow.get("seed"))
+                        if longest_flow.get("seed")
+                        else str(longest_flow.get("noise_seed"))
+                    )
+                case "size":
+                    self._parameter["size"] = str(self._width) + "x" + str(self._height)
+                case _:
+                    self._parameter[p] = str(longest_flow.get(s))
+
+        if self._is_sdxl:
+            if self._wants("positive") and not self._positive and self.positive_sdxl:
+                self._positive = self.merge_clip(self.positive_sdxl)
+            if self._wants("negative") and not self._negative and self.negative_sdxl:
+                self._negative = self.merge_clip(self.negative_sdxl)
+            empty_prompt = (0 if self._positive_sdxl else 1) + (
+                0 if self._negative_sdxl else 1
+            )
+        else:
+            empty_prompt = (0 if self._positive else 1) + (0 if self._negative else 1)
+
+        empty_param = sum(1 for x in self._parameter.values() if x == "None")
+
+        if empty_prompt + empty_param > (6 + 2) / 2 or empty_prompt == 2:
+            raise ValueError("More than half of the parameters cannot be parsed")
+
+    def _comfy_raw(self):
         if not self._is_sdxl:
             self._raw = "\n".join(
                 [
@@ -120,6 +163,7 @@ class ComfyUI(BaseFormat):
         if self._workflow:
             self._raw += "\n" + str(self._workflow)
 
+    def _comfy_setting(self, longest_flow: dict):
         add_noise = (
             f"Add noise: {remove_quotes(longest_flow.get('add_noise'))}"
             if longest_flow.get("add_noise")
@@ -192,37 +236,6 @@ class ComfyUI(BaseFormat):
             )
         )
 
-        for p, s in zip(super().PARAMETER_KEY, ComfyUI.SETTING_KEY):
-            match p:
-                case k if k in ("model", "sampler"):
-                    self._parameter[p] = str(remove_quotes(longest_flow.get(s)))
-                case "seed":
-                    self._parameter[p] = (
-                        str(longest_flow.get("seed"))
-                        if longest_flow.get("seed")
-                        else str(longest_flow.get("noise_seed"))
-                    )
-                case "size":
-                    self._parameter["size"] = str(self._width) + "x" + str(self._height)
-                case _:
-                    self._parameter[p] = str(longest_flow.get(s))
-
-        if self._is_sdxl:
-            if not self._positive and self.positive_sdxl:
-                self._positive = self.merge_clip(self.positive_sdxl)
-            if not self._negative and self.negative_sdxl:
-                self._negative = self.merge_clip(self.negative_sdxl)
-            empty_prompt = (0 if self._positive_sdxl else 1) + (
-                0 if self._negative_sdxl else 1
-            )
-        else:
-            empty_prompt = (0 if self._positive else 1) + (0 if self._negative else 1)
-
-        empty_param = sum(1 for x in self._parameter.values() if x == "None")
-
-        if empty_prompt + empty_param > (6 + 2) / 2 or empty_prompt == 2:
-            raise ValueError("More than half of the parameters cannot be parsed")
-
     @staticmethod
     def merge_clip(data: dict):
         clip_g = data.get("Clip G").strip(" ,")
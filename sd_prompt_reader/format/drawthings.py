@@ -5,7 +5,7 @@ __email__ = "receyuki@gmail.com"
 
 
 from ..format.base_format import BaseFormat
-from ..utility import remove_quotes
+from ..string_utility import remove_quotes
 
 
 class DrawThings(BaseFormat):
@@ -22,8 +22,10 @@ class DrawThings(BaseFormat):
         self._tool = "Draw Things"
         self._positive = data_json.pop("c").strip()
         self._negative = data_json.pop("uc").strip()
-        self._raw = "\n".join([self._positive, self._negative, str(data_json)])
-        self._setting = remove_quotes(str(data_json).strip("{ }"))
+        if self._wants("raw"):
+            self._raw = "\n".join([self._positive, self._negative, str(data_json)])
+        if self._wants("setting"):
+            self._setting = remove_quotes(str(data_json).strip("{ }"))
         [self._width, self._height] = data_json.get("size", "0x0").split("x")
 
         for p, s in zip(super().PARAMETER_KEY, DrawThings.SETTING_KEY):
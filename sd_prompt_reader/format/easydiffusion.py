@@ -7,7 +7,7 @@ import json
 from pathlib import PureWindowsPath, PurePosixPath
 
 from ..format.base_format import BaseFormat
-from ..utility import remove_quotes
+from ..string_utility import remove_quotes
 
 
 class EasyDiffusion(BaseFormat):
@@ -63,9 +63,10 @@ class EasyDiffusion(BaseFormat):
         else:
             file = PurePosixPath(data_json.get(ed["use_stable_diffusion_model"])).name
 
-        self._setting = (
-            remove_quotes(str(data_json)).replace("{", "").replace("}", "")
-        ).strip()
+        if self._wants("setting"):
+            self._setting = (
+                remove_quotes(str(data_json)).replace("{", "").replace("}", "")
+            ).strip()
 
         self._width = str(data_json.get(ed["width"]))
         self._height = str(data_json.get(ed["height"]))
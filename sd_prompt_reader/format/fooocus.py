@@ -5,7 +5,7 @@ __email__ = "receyuki@gmail.com"
 
 
 from ..format.base_format import BaseFormat
-from ..utility import remove_quotes
+from ..string_utility import remove_quotes
 
 
 class Fooocus(BaseFormat):
@@ -29,10 +29,12 @@ class Fooocus(BaseFormat):
         self._tool = "Fooocus"
         self._positive = data_json.get("prompt").strip()
         self._negative = data_json.get("negative_prompt").strip()
-        self._raw = "\n".join([self._positive, self._negative, str(data_json)])
+        if self._wants("raw"):
+            self._raw = "\n".join([self._positive, self._negative, str(data_json)])
         data_json.pop("prompt")
         data_json.pop("negative_prompt")
-        self._setting = remove_quotes(str(data_json)[1:-1]).strip()
+        if self._wants("setting"):
+            self._setting = remove_quotes(str(data_json)[1:-1]).strip()
         self._width = str(data_json.get("width"))
         self._height = str(data_json.get("height"))
 
@@ -7,7 +7,7 @@ import json
 import re
 
 from ..format.base_format import BaseFormat
-from ..utility import remove_quotes
+from ..string_utility import remove_quotes
 
 
 class InvokeAI(BaseFormat):
@@ -51,8 +51,10 @@ class InvokeAI(BaseFormat):
         data_json = json.loads(self._info.get("invokeai_metadata"))
         self._positive = data_json.pop("positive_prompt").strip()
         self._negative = data_json.pop("negative_prompt").strip()
-        self._raw = "\n".join([self._positive, self._negative, str(data_json)])
-        self._setting = remove_quotes(str(data_json)).strip("{ }")
+        if self._wants("raw"):
+            self._raw = "\n".join([self._positive, self._negative, str(data_json)])
+        if self._wants("setting"):
+            self._setting = remove_quotes(str(data_json)).strip("{ }")
         self._width = str(data_json.get("width"))
         self._height = str(data_json.get("height"))
 
@@ -95,23 +97,25 @@ class InvokeAI(BaseFormat):
 
         self._positive, self._negative = self.split_prompt(prompt)
 
-        raw_list = [
-            item
-            for item in [
-                self._positive,
-                self._negative,
-                self._info.get("Dream"),
-                self._info.get("sd-metadata"),
+        if self._wants("raw"):
+            raw_list = [
+                item
+                for item in [
+                    self._positive,
+                    self._negative,
+                    self._info.get("Dream"),
+                    self._info.get("sd-metadata"),
+                ]
+                if item != ""
             ]
-            if item != ""
-        ]
 
-        self._raw = "\n".join(raw_list).strip()
+            self._raw = "\n".join(raw_list).strip()
 
         image.pop("prompt")
-        self._setting = remove_quotes(
-            ", ".join([str(data_json).strip("{ }"), str(image).strip("{ }")])
-        )
+        if self._wants("setting"):
+            self._setting = remove_quotes(
+                ", ".join([str(data_json).strip("{ }"), str(image).strip("{ }")])
+            )
 
         self._width = str(image.get("width"))
         self._height = str(image.get("height"))
@@ -135,7 +139,10 @@ class InvokeAI(BaseFormat):
         prompt, setting = re.search(pattern, data).groups()
         self._positive, self._negative = self.split_prompt(prompt.strip('" '))
 
-        self._raw = "\n".join([self._positive, self.negative, self._info.get("Dream")])
+        if self._wants("raw"):
+            self._raw = "\n".join(
+                [self._positive, self.negative, self._info.get("Dream")]
+            )
 
         # match parameters like "-s 30"
         pattern = r"-(\w+)\s+([\w.-]+)"
@@ -7,7 +7,7 @@ import json
 import gzip
 
 from ..format.base_format import BaseFormat
-from ..utility import remove_quotes
+from ..string_utility import remove_quotes
 
 
 class NovelAI(BaseFormat):
@@ -49,6 +49,9 @@ class NovelAI(BaseFormat):
 
         def get_one_byte(self):
             while self.bits < 8:
+                # out of pixels, get_next_n_bytes stops on an empty byte
+                if self.col >= self.width:
+                    return bytearray()
                 self._extract_next_bit()
             byte = bytearray([self.byte])
             self.bits = 0
@@ -91,14 +94,18 @@ class NovelAI(BaseFormat):
 
     def _nai_legacy(self):
         self._positive = self._info.get("Description").strip()
-        self._raw += self._positive
         data = self._info.get("Comment") or {}
         data_json = json.loads(data)
         self._negative = data_json.get("uc").strip()
-        self._raw += "\n".join([self._positive, self.negative, str(data_json)]).strip()
+        if self._wants("raw"):
+            self._raw += self._positive
+            self._raw += "\n".join(
+                [self._positive, self.negative, str(data_json)]
+            ).strip()
 
         data_json.pop("uc")
-        self._setting = remove_quotes(str(data_json)).strip("{ }")
+        if self._wants("setting"):
+            self._setting = remove_quotes(str(data_json)).strip("{ }")
 
         for p, s in zip(super().PARAMETER_KEY, NovelAI.SETTING_KEY_LEGACY):
             match p:
@@ -113,7 +120,8 @@ class NovelAI(BaseFormat):
         read_len = self._extractor.read_32bit_integer() // 8
         json_data = self._extractor.get_next_n_bytes(read_len)
         json_data = json.loads(gzip.decompress(json_data).decode("utf-8"))
-        self._raw = str(json_data)
+        if self._wants("raw"):
+            self._raw = str(json_data)
         if "Comment" in json_data:
             json_data = json_data | json.loads(json_data["Comment"])
             json_data.pop("Comment")
@@ -124,7 +132,8 @@ class NovelAI(BaseFormat):
         else:
             self._positive = json_data.get("Description").strip()
         json_data.pop("Description")
-        self._setting = remove_quotes(str(json_data)).strip("{ }")
+        if self._wants("setting"):
+            self._setting = remove_quotes(str(json_data)).strip("{ }")
         for p, s in zip(super().PARAMETER_KEY, NovelAI.SETTING_KEY_STEALTH):
             match p:
                 case "size":
@@ -6,7 +6,7 @@ __email__ = "receyuki@gmail.com"
 import json
 
 from ..format.base_format import BaseFormat
-from ..utility import remove_quotes
+from ..string_utility import remove_quotes
 
 
 class SwarmUI(BaseFormat):
@@ -24,10 +24,14 @@ class SwarmUI(BaseFormat):
         data_json = self._info.get("sui_image_params")
         self._positive = data_json.get("prompt").strip()
         self._negative = data_json.get("negativeprompt").strip()
-        self._raw = "\n".join([self._positive, self._negative, str(data_json)]).strip()
+        if self._wants("raw"):
+            self._raw = "\n".join(
+                [self._positive, self._negative, str(data_json)]
+            ).strip()
         data_json.pop("prompt")
         data_json.pop("negativeprompt")
-        self._setting = remove_quotes(str(data_json).strip("{ }"))
+        if self._wants("setting"):
+            self._setting = remove_quotes(str(data_json).strip("{ }"))
         self._width = str(data_json.get("width"))
         self._height = str(data_json.get("height"))
 
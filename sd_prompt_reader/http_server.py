@@ -0,0 +1,296 @@
+__author__ = "receyuki"
+__filename__ = "http_server.py"
+__copyright__ = "Copyright 2024"
+__email__ = "receyuki@gmail.com"
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from .format.base_format import BaseFormat
+from .logger import Logger, log_event
+from .metrics import registry
+from .pipeline import read_file
+from .result import ParseResult, normalize_fields
+from .rpc import CACHE_SIZE, ResultCache
+
+HOST = "127.0.0.1"
+PORT = 8765
+# image bytes accepted by POST /read
+MAX_BODY = 64 * 1024 * 1024
+# parse jobs queued per worker process, beyond that requests wait and
+# their connections stop being read
+QUEUE_PER_WORKER = 4
+KEEP_ALIVE_TIMEOUT = 15
+
+logger = Logger("SD_Prompt_Reader.HttpServer")
+
+
+class HttpError(Exception):
+    def __init__(self, status: HTTPStatus, message: str = None):
+        super().__init__(message or status.phrase)
+        self.status = status
+        self.message = message or status.phrase
+
+
+def read_bytes(data: bytes, fields: frozenset) -> tuple[dict, dict]:
+    """Parse an uploaded image inside a worker process.
+
+    The metrics recorded by the worker are returned with the record.
+    """
+    from .image_data_reader import ImageDataReader
+
+    keep = ("raw",) if "raw" in fields else ()
+    try:
+        result = ImageDataReader.from_buffer(
+            data, slim=True, keep=keep, fields=fields
+        ).result
+    except Exception as e:
+        log_event(logger, logging.WARNING, "读取失败", file="上传的图片", error=e)
+        result = ParseResult(status=BaseFormat.Status.FORMAT_ERROR)
+    return result.to_dict(fields), registry.drain()
+
+
+def read_path(path: str, fields: frozenset) -> tuple[dict, dict]:
+    """Parse a file inside a worker process, see read_bytes."""
+    keep = ("raw",) if "raw" in fields else ()
+    result = read_file(path, keep=keep, fields=fields)
+    return {"file": path, **result.to_dict(fields)}, registry.drain()
+
+
+def _fields(value) -> frozenset:
+    try:
+        return normalize_fields(value or "props")
+    except ValueError as e:
+        raise HttpError(HTTPStatus.BAD_REQUEST, str(e))
+
+
+class HttpServer:
+    """asyncio HTTP/1.1 front end to a bounded process pool.
+
+    POST /read takes image bytes, POST /batch a JSON list of paths,
+    GET /stats reports the server counters and GET /metrics the metrics
+    registry as Prometheus text, or JSON with ?format=json. Results are shared through
+    one ResultCache, uploads are keyed by their hash and paths by size
+    and mtime.
+    """
+
+    def __init__(
+        self,
+        host: str = HOST,
+        port: int = PORT,
+        workers: int = 1,
+        cache_size: int = CACHE_SIZE,
+    ):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.cache = ResultCache(cache_size)
+        self.requests = 0
+        self.in_flight = 0
+        self._pool = None
+        self._slots = None
+        self._started = None
+
+    async def start(self) -> asyncio.AbstractServer:
+        # multiprocessing is only imported once the server starts
+        from concurrent.futures import ProcessPoolExecutor
+
+        # forked workers must not count the metrics of the server again
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=registry.reset
+        )
+        self._slots = asyncio.Semaphore(self.workers * QUEUE_PER_WORKER)
+        self._started = time.monotonic()
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        logger.info(f"服务已启动：http://{self.host}:{self.port}")
+        return server
+
+    async def serve(self):
+        server = await self.start()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self._pool.shutdown(cancel_futures=True)
+
+    async def _run(self, func, *args):
+        # waiting for a slot is the backpressure: the connection is not
+        # read again until its job is queued
+        async with self._slots:
+            self.in_flight += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self._pool, func, *args
+                )
+            finally:
+                self.in_flight -= 1
+
+    async def _cached(self, key: tuple, func, *args) -> dict:
+        record = self.cache.get(key)
+        if record is None:
+            record, metrics = await self._run(func, *args)
+            registry.merge(metrics)
+            self.cache.put(key, record)
+        return record
+
+    async def _read(self, body: bytes, query: dict) -> dict:
+        if not body:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Empty body")
+        fields = _fields(query.get("fields", [None])[0])
+        key = ("sha256", hashlib.sha256(body).hexdigest(), fields)
+        return await self._cached(key, read_bytes, body, fields)
+
+    async def _read_path(self, path, fields: frozenset) -> dict:
+        if not isinstance(path, str):
+            return {"file": path, "error": "path must be a string"}
+        try:
+            key = self.cache.key(path, fields)
+        except OSError as e:
+            return {"file": path, "error": str(e)}
+        return await self._cached(key, read_path, path, fields)
+
+    async def _batch(self, body: bytes, query: dict) -> dict:
+        try:
+            request = json.loads(body)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid JSON")
+        if isinstance(request, list):
+            request = {"paths": request}
+        if not isinstance(request, dict) or not isinstance(request.get("paths"), list):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Expected a list of paths")
+        fields = _fields(request.get("fields") or query.get("fields", [None])[0])
+        results = await asyncio.gather(
+            *(self._read_path(path, fields) for path in request["paths"])
+        )
+        return {"results": results}
+
+    def _stats(self, query: dict) -> dict:
+        return {
+            "uptime": round(time.monotonic() - self._started, 3),
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "workers": self.workers,
+            "cache": {
+                "size": len(self.cache),
+                "hits": self.cache.hits,
+                "misses": self.cache.misses,
+            },
+        }
+
+    def _metrics(self, query: dict):
+        if query.get("format", ["prometheus"])[0] == "json":
+            return registry.to_dict()
+        return registry.to_prometheus()
+
+    async def _dispatch(self, method: str, target: str, body: bytes):
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        routes = {
+            "/read": ("POST", self._read),
+            "/batch": ("POST", self._batch),
+            "/stats": ("GET", self._stats),
+            "/metrics": ("GET", self._metrics),
+        }
+        if url.path not in routes:
+            raise HttpError(HTTPStatus.NOT_FOUND)
+        allowed, handler = routes[url.path]
+        if method != allowed:
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED)
+        if allowed == "GET":
+            return handler(query)
+        return await handler(body, query)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(
+                        reader.readline(), KEEP_ALIVE_TIMEOUT
+                    )
+                except asyncio.TimeoutError:
+                    break
+                if not request_line.strip():
+                    break
+                keep_alive = await self._respond(reader, writer, request_line)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            logger.debug("客户端已断开连接")
+        except ValueError:
+            # a request or header line over the stream limit
+            await self._send(writer, HTTPStatus.BAD_REQUEST, None, False)
+        finally:
+            writer.close()
+
+    async def _respond(self, reader, writer, request_line: bytes) -> bool:
+        """Answer one request, returning whether the connection stays open."""
+        self.requests += 1
+        try:
+            method, target, version = request_line.decode("latin-1").split()
+        except ValueError:
+            await self._send(writer, HTTPStatus.BAD_REQUEST, None, False)
+            return False
+        headers = {}
+        while (line := await reader.readline()).strip():
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        connection = headers.get("connection", "").lower()
+        keep_alive = (
+            connection != "close"
+            if version == "HTTP/1.1"
+            else connection == "keep-alive"
+        )
+        try:
+            if "chunked" in headers.get("transfer-encoding", "").lower():
+                # the unread chunks would be taken for the next request
+                keep_alive = False
+                raise HttpError(HTTPStatus.LENGTH_REQUIRED)
+            try:
+                length = int(headers.get("content-length", 0))
+            except ValueError:
+                raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+            if length > MAX_BODY:
+                # the unread body would be taken for the next request
+                keep_alive = False
+                raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            body = await reader.readexactly(length) if length > 0 else b""
+            status, payload = HTTPStatus.OK, await self._dispatch(method, target, body)
+        except HttpError as e:
+            status, payload = e.status, {"error": e.message}
+        except Exception as e:
+            # answer instead of dropping the connection
+            logger.exception(f"请求失败：{method} {target}（{e}）")
+            status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, None
+        await self._send(writer, status, payload, keep_alive)
+        return keep_alive
+
+    @staticmethod
+    async def _send(writer, status: HTTPStatus, payload, keep_alive: bool):
+        if payload is None:
+            payload = {"error": status.phrase}
+        if isinstance(payload, str):
+            # the Prometheus text format
+            body = payload.encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            content_type = "application/json; charset=utf-8"
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            "\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+def serve_http(host: str = HOST, port: int = PORT, workers: int = 1):
+    asyncio.run(HttpServer(host, port, workers).serve())
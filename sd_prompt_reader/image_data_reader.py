@@ -3,17 +3,22 @@ __filename__ = "image_data_reader.py"
 __copyright__ = "Copyright 2023"
 __email__ = "receyuki@gmail.com"
 
+import io
 import json
+import logging
+import os
+import time
+from contextlib import nullcontext
 from pathlib import Path
-from xml.dom import minidom
 
-import piexif
-import piexif.helper
-from PIL import Image
-from PIL.PngImagePlugin import PngInfo
-
-from .logger import Logger
+# PIL, piexif and minidom are imported where they are used, reading a
+# container never decodes pixels and the CLI should not pay for them
+from .logger import Logger, log_event
 from .constants import PARAMETER_PLACEHOLDER
+from .container import Container, scan, scan_file, exif_tag, EXIF_MODEL
+from .result import ParseResult, normalize_fields, is_detection_only
+from .metrics import BYTES_READ, FILE_BYTES, FILES, PARSE_SECONDS, STEALTH_PROBES
+from .timing import stage
 from .format import (
     BaseFormat,
     A1111,
@@ -27,10 +32,30 @@ from .format import (
 )
 
 
+def _count_bytes(image_format: str, size: int, read: int = None):
+    # Pillow reads the whole file when the scanners could not
+    FILE_BYTES.inc(size, format=image_format)
+    BYTES_READ.inc(size if read is None else read, format=image_format)
+
+
+def _open_image(file):
+    from PIL import Image
+
+    return Image.open(file)
+
+
 class ImageDataReader:
     NOVELAI_MAGIC = "stealth_pngcomp"
 
-    def __init__(self, file, is_txt: bool = False):
+    def __init__(
+        self,
+        file,
+        is_txt: bool = False,
+        slim: bool = False,
+        keep: tuple = (),
+        fields=None,
+        lazy: bool = False,
+    ):
         self._height = None
         self._width = None
         self._info = {}
@@ -46,188 +71,347 @@ class ImageDataReader:
         self._is_txt = is_txt
         self._is_sdxl = False
         self._format = ""
+        self._mode = ""
         self._props = ""
         self._parser = None
         self._status = BaseFormat.Status.UNREAD
+        self._needs_stealth = False
+        # requested field set, None meaning every field
+        self._fields = normalize_fields(fields)
         self._logger = Logger("SD_Prompt_Reader.ImageDataReader")
-        self.read_data(file)
+        # slim mode: keep only the extracted fields, drop the parser and the
+        # metadata it was parsed from unless explicitly requested via keep
+        self._slim = slim
+        self._keep = keep
+        # lazy mode only records the source, the file is opened on first
+        # access and detection and parsing run as separate stages
+        self._source = file
+        self._detected = False
+        self._parsed = False
+        if not lazy:
+            self.parse()
+
+    @classmethod
+    def from_buffer(cls, buffer, **kwargs):
+        """Read from an in-memory image without copying it.
+
+        The chunk and segment scanners run directly on the buffer, pixels
+        are only decoded when stealth pnginfo has to be probed.
+        """
+        return cls(memoryview(buffer), **kwargs)
+
+    @classmethod
+    def from_container(cls, container: Container):
+        """Classify an already scanned container, nothing else is read.
+
+        Stealth pnginfo is not probed, needs_stealth tells whether it would
+        have to be.
+        """
+        reader = cls(None, lazy=True, fields=("tool",))
+        reader._detected = True
+        reader._detect_container(container, None)
+        if reader._tool and reader._status == BaseFormat.Status.UNREAD:
+            reader._status = BaseFormat.Status.DETECTED
+        return reader
 
     def read_data(self, file):
+        self._source = file
+        self._detected = False
+        self._parsed = False
+        self.parse()
+
+    def detect(self):
+        """Open the source and classify the tool without parsing it."""
+        if not self._detected:
+            self._detected = True
+            self._detect(self._source)
+        return self._status
+
+    def parse(self):
+        """Run detection if needed, then the parser of the detected tool."""
+        if self._parsed:
+            return self._status
+        self.detect()
+        self._parsed = True
+        self._source = None
+        if self._status == BaseFormat.Status.DETECTED and not is_detection_only(
+            self._fields
+        ):
+            start = time.perf_counter()
+            with stage("parse"):
+                self._status = self._parser.parse(self._fields)
+            PARSE_SECONDS.observe(
+                time.perf_counter() - start, parser=type(self._parser).__name__
+            )
+        FILES.inc(tool=self._tool, status=self._status.name)
+        log_event(
+            self._logger, logging.INFO, "Reading Status", status=self._status.name
+        )
+        if self._slim:
+            self.release(self._keep)
+        return self._status
+
+    def _detect(self, file):
         if self._is_txt:
             self._raw = file.read()
             self._parser = A1111(raw=self._raw)
             return
-        with Image.open(file) as f:
+        if isinstance(file, (bytes, bytearray, memoryview)):
+            with stage("scan"):
+                container = scan(file)
+            if container is not None:
+                self._detect_container(container, lambda: io.BytesIO(file))
+                self._count_read(container)
+            else:
+                self._detect_image(io.BytesIO(file))
+                _count_bytes(self._format, len(memoryview(file)))
+        elif isinstance(file, (str, os.PathLike)):
+            # paths are scanned through a read-only mmap of the file
+            with stage("scan"):
+                container = scan_file(file)
+            if container is not None:
+                self._detect_container(container, lambda: file)
+                self._count_read(container)
+            else:
+                self._detect_image(file)
+                _count_bytes(self._format, os.path.getsize(file))
+        else:
+            self._detect_image(file)
+        if self._tool and self._status == BaseFormat.Status.UNREAD:
+            log_event(self._logger, logging.INFO, "Format", tool=self._tool)
+            self._status = BaseFormat.Status.DETECTED
+
+    def _count_read(self, container: Container):
+        # probing stealth pnginfo decodes the whole image
+        _count_bytes(
+            container.format,
+            container.size,
+            container.size if self._needs_stealth else container.metadata_size,
+        )
+
+    def _detect_image(self, file):
+        from PIL import Image
+
+        with stage("open"):
+            image = Image.open(file)
+        with image as f:
             self._width = f.width
             self._height = f.height
             self._info = f.info
             self._format = f.format
-            # swarm legacy format
-            try:
-                exif = json.loads(f.getexif().get(0x0110))
-                if "sui_image_params" in exif:
+            self._mode = f.mode
+            with stage("detect"):
+                self._classify(f.getexif().get(EXIF_MODEL), lambda: nullcontext(f))
+
+    def _detect_container(self, container: Container, source):
+        self._width = container.width
+        self._height = container.height
+        self._info = container.info
+        self._format = container.format
+        self._mode = container.mode
+        # pixels are only decoded if stealth pnginfo has to be probed
+        with stage("detect"):
+            self._classify(
+                exif_tag(container, EXIF_MODEL),
+                (lambda: _open_image(source())) if source else None,
+            )
+
+    def _classify(self, exif_model, open_image):
+        # swarm legacy format
+        try:
+            exif = json.loads(exif_model)
+        except (TypeError, ValueError):
+            exif = None
+        if isinstance(exif, dict) and "sui_image_params" in exif:
+            self._tool = "StableSwarmUI"
+            self._parser = SwarmUI(info=exif)
+        elif self._format == "PNG":
+            if "parameters" in self._info:
+                # swarm format
+                if "sui_image_params" in self._info.get("parameters"):
                     self._tool = "StableSwarmUI"
-                    self._parser = SwarmUI(info=exif)
-            except TypeError:
-                if f.format == "PNG":
-                    if "parameters" in self._info:
+                    self._parser = SwarmUI(raw=self._info.get("parameters"))
+                # a1111 png compatible format
+                else:
+                    if "prompt" in self._info:
+                        self._tool = "ComfyUI\n(A1111 compatible)"
+                    else:
+                        self._tool = "A1111 webUI"
+                    self._parser = A1111(info=self._info)
+            elif "postprocessing" in self._info:
+                self._tool = "A1111 webUI\n(Postprocessing)"
+                self._parser = A1111(info=self._info)
+            # easydiff png format
+            elif "negative_prompt" in self._info or "Negative Prompt" in self._info:
+                self._tool = "Easy Diffusion"
+                self._parser = EasyDiffusion(info=self._info)
+            # invokeai3 format
+            elif "invokeai_metadata" in self._info:
+                self._tool = "InvokeAI"
+                self._parser = InvokeAI(info=self._info)
+            # invokeai2 format
+            elif "sd-metadata" in self._info:
+                self._tool = "InvokeAI"
+                self._parser = InvokeAI(info=self._info)
+            # invokeai legacy dream format
+            elif "Dream" in self._info:
+                self._tool = "InvokeAI"
+                self._parser = InvokeAI(info=self._info)
+            # novelai legacy format
+            elif self._info.get("Software") == "NovelAI":
+                self._tool = "NovelAI"
+                self._parser = NovelAI(
+                    info=self._info, width=self._width, height=self._height
+                )
+            # comfyui format
+            elif "prompt" in self._info:
+                self._tool = "ComfyUI"
+                self._parser = ComfyUI(
+                    info=self._info, width=self._width, height=self._height
+                )
+            # fooocus format
+            elif "Comment" in self._info:
+                try:
+                    self._tool = "Fooocus"
+                    self._parser = Fooocus(info=json.loads(self._info.get("Comment")))
+                except Exception:
+                    self._logger.warn("Fooocus format error")
+            # drawthings format
+            elif "XML:com.adobe.xmp" in self._info:
+                from xml.dom import minidom
+
+                try:
+                    data = minidom.parseString(self._info.get("XML:com.adobe.xmp"))
+                    data_json = json.loads(
+                        data.getElementsByTagName("exif:UserComment")[0]
+                        .childNodes[1]
+                        .childNodes[1]
+                        .childNodes[0]
+                        .data
+                    )
+                except Exception:
+                    self._logger.warn("Draw things format error")
+                    self._status = BaseFormat.Status.FORMAT_ERROR
+                else:
+                    self._tool = "Draw Things"
+                    self._parser = DrawThings(info=data_json)
+            # novelai stealth pnginfo format
+            elif self._mode == "RGBA":
+                with stage("stealth"):
+                    self._classify_stealth(open_image)
+        elif self._format in ["JPEG", "WEBP"]:
+            # fooocus jpeg format
+            if "comment" in self._info:
+                try:
+                    self._tool = "Fooocus"
+                    self._parser = Fooocus(info=json.loads(self._info.get("comment")))
+                except Exception:
+                    self._logger.warn("Fooocus format error")
+                    self._status = BaseFormat.Status.FORMAT_ERROR
+            elif self._mode == "RGBA":
+                with stage("stealth"):
+                    self._classify_stealth(open_image)
+            else:
+                import piexif
+                import piexif.helper
+
+                try:
+                    exif = piexif.load(self._info.get("exif")) or {}
+                    user_comment = exif.get("Exif").get(piexif.ExifIFD.UserComment)
+                except TypeError:
+                    self._logger.warn("Empty jpeg")
+                    self._status = BaseFormat.Status.FORMAT_ERROR
+                except Exception:
+                    pass
+                else:
+                    try:
                         # swarm format
-                        if "sui_image_params" in self._info.get("parameters"):
+                        if "sui_image_params" in user_comment[8:].decode("utf-16"):
                             self._tool = "StableSwarmUI"
-                            self._parser = SwarmUI(raw=self._info.get("parameters"))
-                        # a1111 png compatible format
+                            self._parser = SwarmUI(
+                                raw=user_comment[8:].decode("utf-16")
+                            )
                         else:
-                            if "prompt" in self._info:
-                                self._tool = "ComfyUI\n(A1111 compatible)"
+                            self._raw = piexif.helper.UserComment.load(user_comment)
+                            # easydiff jpeg and webp format
+                            if self._raw[0] == "{":
+                                self._tool = "Easy Diffusion"
+                                self._parser = EasyDiffusion(raw=self._raw)
+                            # a1111 jpeg and webp format
                             else:
                                 self._tool = "A1111 webUI"
-                            self._parser = A1111(info=self._info)
-                    elif "postprocessing" in self._info:
-                        self._tool = "A1111 webUI\n(Postprocessing)"
-                        self._parser = A1111(info=self._info)
-                    # easydiff png format
-                    elif (
-                        "negative_prompt" in self._info
-                        or "Negative Prompt" in self._info
-                    ):
-                        self._tool = "Easy Diffusion"
-                        self._parser = EasyDiffusion(info=self._info)
-                    # invokeai3 format
-                    elif "invokeai_metadata" in self._info:
-                        self._tool = "InvokeAI"
-                        self._parser = InvokeAI(info=self._info)
-                    # invokeai2 format
-                    elif "sd-metadata" in self._info:
-                        self._tool = "InvokeAI"
-                        self._parser = InvokeAI(info=self._info)
-                    # invokeai legacy dream format
-                    elif "Dream" in self._info:
-                        self._tool = "InvokeAI"
-                        self._parser = InvokeAI(info=self._info)
-                    # novelai legacy format
-                    elif self._info.get("Software") == "NovelAI":
-                        self._tool = "NovelAI"
-                        self._parser = NovelAI(
-                            info=self._info, width=self._width, height=self._height
-                        )
-                    # comfyui format
-                    elif "prompt" in self._info:
-                        self._tool = "ComfyUI"
-                        self._parser = ComfyUI(
-                            info=self._info, width=self._width, height=self._height
-                        )
-                    # fooocus format
-                    elif "Comment" in self._info:
-                        try:
-                            self._tool = "Fooocus"
-                            self._parser = Fooocus(
-                                info=json.loads(self._info.get("Comment"))
-                            )
-                        except Exception:
-                            self._logger.warn("Fooocus format error")
-                    # drawthings format
-                    elif "XML:com.adobe.xmp" in self._info:
-                        try:
-                            data = minidom.parseString(
-                                self._info.get("XML:com.adobe.xmp")
-                            )
-                            data_json = json.loads(
-                                data.getElementsByTagName("exif:UserComment")[0]
-                                .childNodes[1]
-                                .childNodes[1]
-                                .childNodes[0]
-                                .data
-                            )
-                        except Exception:
-                            self._logger.warn("Draw things format error")
-                            self._status = BaseFormat.Status.FORMAT_ERROR
-                        else:
-                            self._tool = "Draw Things"
-                            self._parser = DrawThings(info=data_json)
-                    # novelai stealth pnginfo format
-                    elif f.mode == "RGBA":
-                        try:
-                            reader = NovelAI.LSBExtractor(f)
-                            read_magic = reader.get_next_n_bytes(
-                                len(self.NOVELAI_MAGIC)
-                            ).decode("utf-8")
-                            assert (
-                                self.NOVELAI_MAGIC == read_magic
-                            ), "NovelAI stealth png info magic number error"
-                        except Exception as e:
-                            self._logger.warn(e)
-                            self._status = BaseFormat.Status.FORMAT_ERROR
-                        else:
-                            self._tool = "NovelAI"
-                            self._parser = NovelAI(extractor=reader)
-                elif f.format in ["JPEG", "WEBP"]:
-                    # fooocus jpeg format
-                    if "comment" in self._info:
-                        try:
-                            self._tool = "Fooocus"
-                            self._parser = Fooocus(
-                                info=json.loads(self._info.get("comment"))
-                            )
-                        except Exception:
-                            self._logger.warn("Fooocus format error")
-                            self._status = BaseFormat.Status.FORMAT_ERROR
-                    elif f.mode == "RGBA":
-                        try:
-                            reader = NovelAI.LSBExtractor(f)
-                            read_magic = reader.get_next_n_bytes(
-                                len(self.NOVELAI_MAGIC)
-                            ).decode("utf-8")
-                            assert (
-                                self.NOVELAI_MAGIC == read_magic
-                            ), "NovelAI stealth png info magic number error"
-                        except Exception as e:
-                            self._logger.warn(e)
-                            self._status = BaseFormat.Status.FORMAT_ERROR
-                        else:
-                            self._tool = "NovelAI"
-                            self._parser = NovelAI(extractor=reader)
-                    else:
-                        try:
-                            exif = piexif.load(self._info.get("exif")) or {}
-                            user_comment = exif.get("Exif").get(
-                                piexif.ExifIFD.UserComment
-                            )
-                        except TypeError:
-                            self._logger.warn("Empty jpeg")
-                            self._status = BaseFormat.Status.FORMAT_ERROR
-                        except Exception:
-                            pass
-                        else:
-                            try:
-                                # swarm format
-                                if "sui_image_params" in user_comment[8:].decode(
-                                    "utf-16"
-                                ):
-                                    self._tool = "StableSwarmUI"
-                                    self._parser = SwarmUI(
-                                        raw=user_comment[8:].decode("utf-16")
-                                    )
-                                else:
-                                    self._raw = piexif.helper.UserComment.load(
-                                        user_comment
-                                    )
-                                    # easydiff jpeg and webp format
-                                    if self._raw[0] == "{":
-                                        self._tool = "Easy Diffusion"
-                                        self._parser = EasyDiffusion(raw=self._raw)
-                                    # a1111 jpeg and webp format
-                                    else:
-                                        self._tool = "A1111 webUI"
-                                        self._parser = A1111(raw=self._raw)
-                            except Exception:
-                                self._status = BaseFormat.Status.FORMAT_ERROR
-            if self._tool and self._status == BaseFormat.Status.UNREAD:
-                self._logger.info(f"Format: {self._tool}")
-                self._status = self._parser.parse()
-            self._logger.info(f"Reading Status: {self._status.name}")
+                                self._parser = A1111(raw=self._raw)
+                    except Exception:
+                        self._status = BaseFormat.Status.FORMAT_ERROR
+
+    def _classify_stealth(self, open_image):
+        self._needs_stealth = True
+        if open_image is None:
+            return
+        try:
+            with open_image() as image:
+                reader = NovelAI.LSBExtractor(image)
+            read_magic = reader.get_next_n_bytes(len(self.NOVELAI_MAGIC)).decode(
+                "utf-8"
+            )
+            assert (
+                self.NOVELAI_MAGIC == read_magic
+            ), "NovelAI stealth png info magic number error"
+        except Exception as e:
+            self._logger.warn(e)
+            self._status = BaseFormat.Status.FORMAT_ERROR
+            STEALTH_PROBES.inc(result="absent")
+        else:
+            self._tool = "NovelAI"
+            self._parser = NovelAI(extractor=reader)
+            STEALTH_PROBES.inc(result="found")
+
+    def release(self, keep: tuple = ()):
+        """Copy the parsed fields out of the parser and drop it.
+
+        info and raw are released as well unless listed in keep. Methods
+        that need the parser, such as prompt_to_line, are unavailable after.
+        """
+        if self._parser:
+            self._height = self._parser.height
+            self._width = self._parser.width
+            self._positive = self._parser.positive
+            self._negative = self._parser.negative
+            self._positive_sdxl = self._parser.positive_sdxl
+            self._negative_sdxl = self._parser.negative_sdxl
+            self._setting = self._parser.setting
+            self._raw = self._parser.raw or self._raw
+            self._parameter = self._parser.parameter
+            self._is_sdxl = self._parser.is_sdxl
+            self._parser = None
+        if "info" not in keep:
+            self._info = {}
+        if "raw" not in keep:
+            self._raw = ""
+
+    @property
+    def result(self):
+        self.parse()
+        return ParseResult(
+            tool=self.tool,
+            status=self.status,
+            format=self.format,
+            width=self.width,
+            height=self.height,
+            positive=self.positive,
+            negative=self.negative,
+            positive_sdxl=self.positive_sdxl,
+            negative_sdxl=self.negative_sdxl,
+            is_sdxl=self.is_sdxl,
+            setting=self.setting,
+            parameter=self.parameter,
+            raw=self.raw,
+        )
 
     @staticmethod
     def remove_data(image_file):
+        from PIL import Image
+
         with Image.open(image_file) as f:
             image_data = list(f.getdata())
             image_without_exif = Image.new(f.mode, f.size)
@@ -236,6 +420,11 @@ class ImageDataReader:
 
     @staticmethod
     def save_image(image_path, new_path, image_format, data=None):
+        import piexif
+        import piexif.helper
+        from PIL import Image
+        from PIL.PngImagePlugin import PngInfo
+
         src_path = Path(image_path)
         dst_path = Path(new_path)
         if src_path.resolve(strict=False) == dst_path.resolve(strict=False):
@@ -312,9 +501,11 @@ class ImageDataReader:
         )
 
     def prompt_to_line(self):
+        self.parse()
         return self._parser.prompt_to_line()
 
     def _json_metadata_field(self, key: str):
+        self.detect()
         value = (self._info or {}).get(key)
         if value in (None, ""):
             return None
@@ -335,60 +526,82 @@ class ImageDataReader:
 
     @property
     def height(self):
-        return self._parser.height if self._tool else self._height
+        self.parse()
+        return self._parser.height if self._parser else self._height
 
     @property
     def width(self):
-        return self._parser.width if self._tool else self._width
+        self.parse()
+        return self._parser.width if self._parser else self._width
 
     @property
     def info(self):
+        self.detect()
         return self._info
 
     @property
     def positive(self):
-        return self._parser.positive if self._tool else self._positive
+        self.parse()
+        return self._parser.positive if self._parser else self._positive
 
     @property
     def negative(self):
-        return self._parser.negative if self._tool else self._negative
+        self.parse()
+        return self._parser.negative if self._parser else self._negative
 
     @property
     def positive_sdxl(self):
-        return self._parser.positive_sdxl if self._tool else self._positive_sdxl
+        self.parse()
+        return self._parser.positive_sdxl if self._parser else self._positive_sdxl
 
     @property
     def negative_sdxl(self):
-        return self._parser.negative_sdxl if self._tool else self._negative_sdxl
+        self.parse()
+        return self._parser.negative_sdxl if self._parser else self._negative_sdxl
 
     @property
     def setting(self):
-        return self._parser.setting if self._tool else self._setting
+        self.parse()
+        return self._parser.setting if self._parser else self._setting
 
     @property
     def raw(self):
-        return self._parser.raw or self._raw
+        self.parse()
+        return (self._parser.raw if self._parser else "") or self._raw
 
     @property
     def tool(self):
+        self.detect()
         return self._tool
 
     @property
     def parameter(self):
-        return self._parser.parameter if self._tool else self._parameter
+        self.parse()
+        return self._parser.parameter if self._parser else self._parameter
 
     @property
     def format(self):
+        self.detect()
         return self._format
 
     @property
     def is_sdxl(self):
-        return self._parser.is_sdxl if self._tool else self._is_sdxl
+        self.parse()
+        return self._parser.is_sdxl if self._parser else self._is_sdxl
 
     @property
     def props(self):
-        return self._parser.props if self._tool else self._props
+        self.parse()
+        if self._parser:
+            return self._parser.props
+        return self.result.props if self._tool else self._props
+
+    @property
+    def needs_stealth(self):
+        self.detect()
+        return self._needs_stealth
 
     @property
     def status(self):
+        self.detect()
         return self._status
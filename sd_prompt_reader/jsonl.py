@@ -0,0 +1,88 @@
+__author__ = "receyuki"
+__filename__ = "jsonl.py"
+__copyright__ = "Copyright 2024"
+__email__ = "receyuki@gmail.com"
+
+import gzip
+import io
+import json
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+
+from .result import ParseResult
+from .timing import stage
+
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+
+
+def compression_for(path) -> str | None:
+    """Infer the compression from a file suffix, e.g. out.jsonl.gz."""
+    return COMPRESSION_SUFFIXES.get(Path(path).suffix.lower()) if path else None
+
+
+@contextmanager
+def open_jsonl(path=None, compression: str = None):
+    """Open a JSON Lines text stream, stdout when path is None or "-"."""
+    to_stdout = path is None or str(path) == "-"
+    if not compression:
+        if to_stdout:
+            yield sys.stdout
+            return
+        with open(path, "w", encoding="utf-8", newline="\n") as f:
+            yield f
+        return
+    target = sys.stdout.buffer if to_stdout else path
+    match compression:
+        case "gzip":
+            stream = gzip.open(target, "wt", encoding="utf-8", newline="\n")
+        case "zstd":
+            stream = _open_zstd(target)
+        case _:
+            raise ValueError(f"Unsupported compression: {compression}")
+    with stream:
+        yield stream
+
+
+def _open_zstd(target):
+    try:
+        # standard library since Python 3.14
+        from compression import zstd
+    except ImportError:
+        try:
+            import zstandard as zstd
+        except ImportError:
+            raise ImportError("zstd compression requires the zstandard package")
+    return zstd.open(target, "wt", encoding="utf-8", newline="\n")
+
+
+def dumps(file, result: ParseResult, fields: frozenset = None) -> str:
+    """One compact record, the file first and then the fields in FIELDS order."""
+    return dump_record(file, result.to_dict(fields))
+
+
+def dump_record(file, data: dict) -> str:
+    record = {"file": str(file), **data}
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+
+class JsonlWriter:
+    """Write one record per line to an open text stream."""
+
+    def __init__(self, stream: io.TextIOBase, fields: frozenset = None):
+        self.stream = stream
+        self.fields = fields
+        self.count = 0
+
+    def write(self, file, result: ParseResult):
+        with stage("export"):
+            self.stream.write(dumps(file, result, self.fields))
+            self.stream.write("\n")
+        self.count += 1
+
+    def write_record(self, file, data: dict):
+        """Write a record that is not a parse result, e.g. a rename."""
+        with stage("export"):
+            self.stream.write(dump_record(file, data))
+            self.stream.write("\n")
+        self.count += 1
@@ -3,6 +3,7 @@ __filename__ = "logger.py"
 __copyright__ = "Copyright 2024"
 __email__ = "receyuki@gmail.com"
 
+import json
 import logging
 
 
@@ -46,20 +47,34 @@ class Logger:
         return levels.get(level_name.upper(), logging.INFO)
 
     @classmethod
-    def configure_global_logger(cls, level="INFO"):
-        formatter = logging.Formatter(
-            "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-        )
+    def configure_global_logger(cls, level="INFO", json_format=False):
+        """Set the root level and its console handler, safe to call again.
+
+        The handler is added once and only has its formatter replaced on
+        later calls, so records are never printed twice. With json_format
+        every record is one JSON object per line.
+        """
+        formatter = JsonFormatter() if json_format else TextFormatter()
         level_value = cls.get_log_level(level)
 
         # Configure the root logger
         root_logger = logging.getLogger()
         root_logger.setLevel(level_value)
 
-        # Add a stream handler to the root logger
-        stream_handler = logging.StreamHandler()
+        # Reuse the stream handler added by an earlier call
+        stream_handler = next(
+            (
+                handler
+                for handler in root_logger.handlers
+                if getattr(handler, "_sd_prompt_reader", False)
+            ),
+            None,
+        )
+        if stream_handler is None:
+            stream_handler = logging.StreamHandler()
+            stream_handler._sd_prompt_reader = True
+            root_logger.addHandler(stream_handler)
         stream_handler.setFormatter(formatter)
-        root_logger.addHandler(stream_handler)
 
         # Remove any other handlers from root_logger to prevent duplication
         for handler in root_logger.handlers[:]:
@@ -70,3 +85,58 @@ class Logger:
         # file_handler = logging.FileHandler('app.log')
         # file_handler.setFormatter(formatter)
         # root_logger.addHandler(file_handler)
+
+
+def log_event(logger: logging.Logger, level: int, event: str, **fields):
+    """Log an event with key/value fields.
+
+    Below the logger's level this returns before anything is formatted,
+    so it is cheap on the per-file path. The fields are rendered by the
+    handler's formatter, as key=value pairs or JSON keys.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields}, stacklevel=2)
+
+
+class TextFormatter(logging.Formatter):
+    """The console format, with the fields of log_event appended."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    def format(self, record):
+        message = super().format(record)
+        fields = getattr(record, "fields", None)
+        if not fields:
+            return message
+        pairs = " ".join(f"{key}={_text_value(value)}" for key, value in fields.items())
+        return f"{message} {pairs}"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, the fields of log_event as keys."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+            "event": record.getMessage(),
+        }
+        for key, value in (getattr(record, "fields", None) or {}).items():
+            entry[key] = (
+                value
+                if value is None or isinstance(value, (int, float, bool))
+                else str(value)
+            )
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def _text_value(value) -> str:
+    text = str(value)
+    # quoted when it would not read back as one token
+    if not text or any(c in text for c in " =\"\n"):
+        return json.dumps(text, ensure_ascii=False)
+    return text
@@ -0,0 +1,192 @@
+__author__ = "receyuki"
+__filename__ = "manifest.py"
+__copyright__ = "Copyright 2024"
+__email__ = "receyuki@gmail.com"
+
+import hashlib
+import json
+import os
+import sqlite3
+
+from .container import scan_file
+from .database import BATCH_SIZE
+from .result import ParseResult
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS manifest (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    metadata_hash TEXT NOT NULL,
+    digest TEXT
+);
+CREATE INDEX IF NOT EXISTS manifest_hash ON manifest (metadata_hash);
+"""
+CHUNK_SIZE = 1024 * 1024
+
+
+def metadata_hash(path) -> str:
+    """Hash of the metadata region, unaffected by renames and touches.
+
+    Known containers hash the scanned header fields and text chunks, so
+    pixel data is never read; anything else falls back to the whole file.
+    """
+    return _metadata_hash(path)[0]
+
+
+def _metadata_hash(path) -> tuple[str, bool]:
+    # also whether the hash identifies the file, images without metadata
+    # of the same format and size all hash alike
+    digest = hashlib.sha256()
+    container = scan_file(path)
+    if container is None:
+        with open(path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                digest.update(chunk)
+        return digest.hexdigest(), True
+    digest.update(
+        repr(
+            (
+                container.format,
+                container.width,
+                container.height,
+                container.mode,
+                sorted(container.info.items()),
+            )
+        ).encode()
+    )
+    return digest.hexdigest(), bool(container.metadata_size)
+
+
+def result_digest(result: ParseResult) -> str:
+    return hashlib.sha256(
+        json.dumps(result.to_dict(), sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class Manifest:
+    """Record of processed files, so reruns only read what changed.
+
+    A file is skipped when its size and mtime match, or when only its
+    mtime changed but the metadata hash did not. A new path whose size and
+    hash belong to a path that no longer exists is treated as a rename,
+    unless the image has no metadata to tell it apart.
+    """
+
+    def __init__(self, path, batch_size: int = BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.skipped = 0
+        self.renamed = 0
+        self._hashes = {}
+        self._connection = sqlite3.connect(path, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.executescript(SCHEMA)
+        self._pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._connection is None:
+            return
+        self.commit()
+        self._connection.close()
+        self._connection = None
+
+    def commit(self):
+        if self._pending:
+            self._connection.execute("COMMIT")
+            self._pending = 0
+
+    def _execute(self, sql: str, parameters=()):
+        if not self._pending:
+            self._connection.execute("BEGIN")
+        self._connection.execute(sql, parameters)
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.commit()
+
+    def changed_files(self, files, on_rename=None):
+        """Yield the files that need reading.
+
+        on_rename(old, new) is called for each detected rename, after the
+        manifest entry has been moved to the new path.
+        """
+        for file in files:
+            path = os.path.abspath(file)
+            try:
+                stat = os.stat(file)
+                row = self._connection.execute(
+                    "SELECT size, mtime_ns, metadata_hash FROM manifest WHERE path = ?",
+                    (path,),
+                ).fetchone()
+                if row and row[:2] == (stat.st_size, stat.st_mtime_ns):
+                    self.skipped += 1
+                    continue
+                hashed, identifying = _metadata_hash(file)
+            except OSError:
+                # let the reader report it
+                yield file
+                continue
+            if row and row[2] == hashed:
+                # touched, metadata unchanged
+                self._execute(
+                    "UPDATE manifest SET size = ?, mtime_ns = ? WHERE path = ?",
+                    (stat.st_size, stat.st_mtime_ns, path),
+                )
+                self.skipped += 1
+                continue
+            if (
+                not row
+                and identifying
+                and (old := self._moved_from(hashed, stat.st_size))
+            ):
+                self._execute(
+                    "UPDATE manifest SET path = ?, size = ?, mtime_ns = ? WHERE path = ?",
+                    (path, stat.st_size, stat.st_mtime_ns, old),
+                )
+                self.renamed += 1
+                if on_rename:
+                    on_rename(old, file)
+                continue
+            self._hashes[path] = (stat, hashed)
+            yield file
+
+    def _moved_from(self, hashed: str, size: int) -> str | None:
+        # a rename keeps the size as well as the metadata
+        for (old,) in self._connection.execute(
+            "SELECT path FROM manifest WHERE metadata_hash = ? AND size = ?",
+            (hashed, size),
+        ).fetchall():
+            # a copy keeps its source, only a vanished path was renamed
+            if not os.path.exists(old):
+                return old
+        return None
+
+    def record(self, file, result: ParseResult) -> bool:
+        """Store the file's state, True if its result differs from last run."""
+        path = os.path.abspath(file)
+        try:
+            stat, hashed = self._hashes.pop(path, None) or (
+                os.stat(file),
+                metadata_hash(file),
+            )
+        except OSError:
+            return True
+        digest = result_digest(result)
+        row = self._connection.execute(
+            "SELECT digest FROM manifest WHERE path = ?", (path,)
+        ).fetchone()
+        self._execute(
+            "INSERT INTO manifest VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (path) DO UPDATE SET size = excluded.size, "
+            "mtime_ns = excluded.mtime_ns, metadata_hash = excluded.metadata_hash, "
+            "digest = excluded.digest",
+            (path, stat.st_size, stat.st_mtime_ns, hashed, digest),
+        )
+        return not row or row[0] != digest
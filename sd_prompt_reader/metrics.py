@@ -0,0 +1,260 @@
+__author__ = "receyuki"
+__filename__ = "metrics.py"
+__copyright__ = "Copyright 2024"
+__email__ = "receyuki@gmail.com"
+
+# Counters and histograms of what the library reads, exported as
+# Prometheus text or JSON. Every metric has its own lock, so worker
+# threads update them directly. Worker processes start from zero and send
+# their values back with drain(), which the parent merges.
+
+import json
+import threading
+from bisect import bisect_left
+
+# seconds, from a tag lookup to a large ComfyUI graph
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # label values -> value
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def snapshot(self, reset: bool = False) -> dict:
+        with self._lock:
+            values = {key: _copy(value) for key, value in self._values.items()}
+            if reset:
+                self._values.clear()
+        return values
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+    def samples(self):
+        for key, value in sorted(self.snapshot().items()):
+            yield dict(zip(self.labels, key)), value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labels: tuple = (), buckets=LATENCY_BUCKETS
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def _empty(self) -> list:
+        # a count per bucket plus +Inf, the sum and the count
+        return [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = self._empty()
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, (counts, total, count) in values.items():
+                entry = self._values.get(key)
+                if entry is None:
+                    entry = self._values[key] = self._empty()
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+                entry[2] += count
+
+    def samples(self):
+        for key, (counts, total, count) in sorted(self.snapshot().items()):
+            cumulative = []
+            running = 0
+            for bucket in counts:
+                running += bucket
+                cumulative.append(running)
+            yield dict(zip(self.labels, key)), {
+                "buckets": dict(zip([*map(_number, self.buckets), "+Inf"], cumulative)),
+                "sum": total,
+                "count": count,
+            }
+
+
+class Registry:
+    """The metrics of one process, by name."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric_class, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, *args, **kwargs)
+            elif not isinstance(metric, metric_class):
+                raise ValueError(f"{name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self._register(Counter, name, help, labels)
+
+    def histogram(
+        self, name: str, help: str, labels: tuple = (), buckets=LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram, name, help, labels, buckets)
+
+    def metrics(self) -> list:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def drain(self) -> dict:
+        """Take the values recorded since the last drain, for merge()."""
+        return {metric.name: metric.snapshot(reset=True) for metric in self.metrics()}
+
+    def merge(self, values: dict):
+        """Add the values drained from another process."""
+        with self._lock:
+            metrics = dict(self._metrics)
+        for name, metric_values in values.items():
+            if name in metrics:
+                metrics[name].merge(metric_values)
+
+    def reset(self):
+        # forked workers must not report the values of their parent again
+        self.drain()
+
+    def to_dict(self) -> dict:
+        return {
+            metric.name: {
+                "type": metric.kind,
+                "help": metric.help,
+                "samples": [
+                    {"labels": labels, "value": value}
+                    for labels, value in metric.samples()
+                ],
+            }
+            for metric in self.metrics()
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=4)
+
+    def to_prometheus(self) -> str:
+        """The Prometheus text exposition format, version 0.0.4."""
+        lines = []
+        for metric in self.metrics():
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for labels, value in metric.samples():
+                if metric.kind == "histogram":
+                    for bound, count in value["buckets"].items():
+                        lines.append(
+                            f"{metric.name}_bucket{_labels({**labels, 'le': bound})}"
+                            f" {count}"
+                        )
+                    lines.append(
+                        f"{metric.name}_sum{_labels(labels)} {_number(value['sum'])}"
+                    )
+                    lines.append(
+                        f"{metric.name}_count{_labels(labels)} {value['count']}"
+                    )
+                else:
+                    lines.append(f"{metric.name}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _copy(value):
+    if isinstance(value, list):
+        return [list(value[0]), value[1], value[2]]
+    return value
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape_label(str(value))}"' for name, value in labels.items()
+    )
+    return "{" + pairs + "}"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _escape_help(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+registry = Registry()
+
+FILES = registry.counter(
+    "sdpr_files_total", "Images read, by tool and status", ("tool", "status")
+)
+BYTES_READ = registry.counter(
+    "sdpr_bytes_read_total",
+    "Bytes of metadata read, or of the whole image when its pixels were decoded",
+    ("format",),
+)
+FILE_BYTES = registry.counter(
+    "sdpr_file_bytes_total", "Total size of the images read", ("format",)
+)
+PARSE_SECONDS = registry.histogram(
+    "sdpr_parse_seconds", "Time spent in the metadata parser", ("parser",)
+)
+CACHE_REQUESTS = registry.counter(
+    "sdpr_cache_requests_total", "Result cache lookups of the servers", ("result",)
+)
+STEALTH_PROBES = registry.counter(
+    "sdpr_stealth_probes_total",
+    "Images whose pixels were decoded to look for stealth pnginfo",
+    ("result",),
+)
+REMOTE_BYTES = registry.counter(
+    "sdpr_remote_bytes_total",
+    "Bytes transferred for remote images, and the size of those images",
+    ("kind",),
+)
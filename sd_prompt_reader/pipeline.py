@@ -0,0 +1,87 @@
+__author__ = "receyuki"
+__filename__ = "pipeline.py"
+__copyright__ = "Copyright 2024"
+__email__ = "receyuki@gmail.com"
+
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .format.base_format import BaseFormat
+from .image_data_reader import ImageDataReader
+from .logger import Logger, log_event
+from .metrics import registry
+from .remote import fetch, is_url
+from .result import ParseResult
+from .timing import record_file, stage
+
+# results allowed in flight per worker before the consumer has to catch up
+WINDOW_PER_WORKER = 4
+SUCCESS_STATUS = (BaseFormat.Status.READ_SUCCESS, BaseFormat.Status.DETECTED)
+
+logger = Logger("SD_Prompt_Reader.Pipeline")
+
+
+def read_file(file, **kwargs) -> ParseResult:
+    """Read one file into a ParseResult, reporting unreadable files as errors.
+
+    http(s) URLs are read with Range requests, see remote.fetch.
+    """
+    start = time.perf_counter()
+    try:
+        if is_url(file):
+            with stage("fetch"):
+                source = fetch(file)
+        else:
+            source = file
+        result = ImageDataReader(source, slim=True, **kwargs).result
+    except Exception as e:
+        log_event(logger, logging.WARNING, "读取失败", file=file, error=e)
+        result = ParseResult(status=BaseFormat.Status.FORMAT_ERROR)
+    record_file(file, result.tool, start)
+    return result
+
+
+def bounded_map(
+    func, iterable, workers: int = 1, window: int = None, processes: bool = False
+):
+    """Like map, but with at most window items in flight, in input order.
+
+    The input is consumed lazily, so memory stays constant no matter how
+    many items the iterable yields. Workers are threads unless processes
+    is set, which needs func, its arguments and results to be picklable.
+    """
+    if workers <= 1:
+        yield from map(func, iterable)
+        return
+    window = window or workers * WINDOW_PER_WORKER
+    pending = deque()
+    if processes:
+        # multiprocessing is only imported when a process pool is used
+        from concurrent.futures import ProcessPoolExecutor
+
+        # forked workers must not count the metrics of the parent again
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=registry.reset)
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+    with executor:
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+            # finished results go out before waiting on a slow input, such
+            # as paths piped in one at a time
+            while pending and pending[0].done():
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def read_files(files, workers: int = 1, window: int = None, **kwargs):
+    """Yield (file, ParseResult) pairs as the files are read."""
+
+    def read(file):
+        return file, read_file(file, **kwargs)
+
+    yield from bounded_map(read, files, workers, window)
@@ -0,0 +1,347 @@
+__author__ = "receyuki"
+__filename__ = "remote.py"
+__copyright__ = "Copyright 2024"
+__email__ = "receyuki@gmail.com"
+
+# Read the metadata of images behind a plain HTTP server with Range
+# requests. The chunk or segment headers are walked remotely up to the
+# pixel data, text after the pixels of a PNG is found in one read of the
+# file end, and the chunks that were kept are put together into a small
+# buffer for the header-only scanners.
+
+import logging
+import queue
+import struct
+import threading
+import zlib
+
+from .container import JPEG_SIGNATURE, PNG_SIGNATURE, scan
+from .logger import Logger, log_event
+from .metrics import REMOTE_BYTES
+
+URL_SCHEMES = ("http://", "https://")
+# bytes fetched by the first request and by each later read past the
+# fetched data, most metadata fits in the first one
+HEAD_SIZE = 16 * 1024
+READ_AHEAD = 4 * 1024
+# bytes read from the end of a PNG for text that follows the pixels
+TAIL_SIZE = 64 * 1024
+TIMEOUT = 30
+# idle keep-alive connections kept per host
+POOL_SIZE = 8
+PNG_METADATA = (b"IHDR", b"tEXt", b"zTXt", b"iTXt", b"eXIf")
+WEBP_METADATA = (b"VP8X", b"EXIF", b"XMP ")
+
+logger = Logger("SD_Prompt_Reader.Remote")
+
+
+def is_url(path) -> bool:
+    return isinstance(path, str) and path.lower().startswith(URL_SCHEMES)
+
+
+class ConnectionPool:
+    """Idle keep-alive connections per host, shared by the worker threads."""
+
+    def __init__(self, size: int = POOL_SIZE, timeout: float = TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _queue(self, key) -> queue.LifoQueue:
+        with self._lock:
+            return self._idle.setdefault(key, queue.LifoQueue(self.size))
+
+    def request(self, url: str, headers: dict) -> tuple[int, dict, bytes]:
+        """GET url, returning the status, the lowercase headers and the body."""
+        import http.client
+        from urllib.parse import urlsplit
+
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        idle = self._queue(key)
+        # a reused connection may have been closed by the server, retry once
+        for reused in (True, False):
+            try:
+                connection = idle.get_nowait() if reused else None
+            except queue.Empty:
+                continue
+            if connection is None:
+                connection_class = (
+                    http.client.HTTPSConnection
+                    if parts.scheme == "https"
+                    else http.client.HTTPConnection
+                )
+                connection = connection_class(parts.netloc, timeout=self.timeout)
+            try:
+                connection.request("GET", target, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                if reused:
+                    continue
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                try:
+                    idle.put_nowait(connection)
+                except queue.Full:
+                    connection.close()
+            return (
+                response.status,
+                {name.lower(): value for name, value in response.getheaders()},
+                body,
+            )
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                while not idle.empty():
+                    idle.get_nowait().close()
+            self._idle.clear()
+
+
+# one pool per process, so every read of a batch reuses its connections
+pool = ConnectionPool()
+
+
+class RangeReader:
+    """Random access to a remote file, one Range request per missed range.
+
+    Fetched ranges are kept as blocks, merged when they touch, and a read
+    only requests the bytes no block holds yet.
+    """
+
+    def __init__(self, url: str, connections: ConnectionPool = None):
+        self.url = url
+        self.connections = connections or pool
+        self.size = None
+        self.requests = 0
+        self.transferred = 0
+        # start offset -> bytes, only a few blocks per file
+        self._blocks = {}
+
+    def fetch(self, start: int, end: int = None) -> bytes:
+        """Request bytes start..end (inclusive), or the rest of the file."""
+        headers = {"Range": f"bytes={start}-{'' if end is None else end}"}
+        status, response_headers, body = self.connections.request(self.url, headers)
+        self.requests += 1
+        self.transferred += len(body)
+        if status == 206:
+            total = response_headers.get("content-range", "").rpartition("/")[2]
+            if total.isdigit():
+                self.size = int(total)
+        elif status == 200:
+            # Range is not supported, the whole file came back
+            self.size = len(body)
+            self._blocks = {0: body}
+            return body[start : None if end is None else end + 1]
+        elif status == 416:
+            return b""
+        else:
+            raise OSError(f"HTTP {status}: {self.url}")
+        if body:
+            self._store(start, body)
+        return body
+
+    def _store(self, start: int, body: bytes):
+        end = start + len(body)
+        for other in sorted(self._blocks):
+            block = self._blocks[other]
+            if other + len(block) == start:
+                del self._blocks[other]
+                start, body = other, block + body
+            elif other == end:
+                body += self._blocks.pop(other)
+        self._blocks[start] = body
+
+    def _block_at(self, offset: int) -> tuple[int, bytes | None]:
+        for start, block in self._blocks.items():
+            if start <= offset < start + len(block):
+                return start, block
+        return offset, None
+
+    def read(self, offset: int, size: int) -> bytes:
+        end = offset + size
+        if self.size is not None:
+            end = min(end, self.size)
+        parts = []
+        while offset < end:
+            start, block = self._block_at(offset)
+            if block is not None:
+                part = block[offset - start : end - start]
+                parts.append(part)
+                offset += len(part)
+                continue
+            # read ahead, but never again over a block that is cached
+            fetch_end = max(end, offset + READ_AHEAD)
+            following = [start for start in self._blocks if start > offset]
+            if following:
+                fetch_end = min(fetch_end, min(following))
+            if self.size is not None:
+                fetch_end = min(fetch_end, self.size)
+            if not self.fetch(offset, fetch_end - 1):
+                break
+        return b"".join(parts)
+
+
+def _needs_pixels(data: bytes) -> bool:
+    # stealth pnginfo is read from the pixels
+    from .image_data_reader import ImageDataReader
+
+    container = scan(data)
+    return (
+        container is None or ImageDataReader.from_container(container).needs_stealth
+    )
+
+
+def _png_tail(reader: RangeReader) -> bytes | None:
+    """The metadata chunks after the pixels, from one read of the file end.
+
+    The chunks are found by walking from each text chunk candidate to
+    IEND, checking every CRC, as the pixel chunks cannot be walked back.
+    None when the size is unknown.
+    """
+    if reader.size is None:
+        return None
+    start = max(0, reader.size - TAIL_SIZE)
+    tail = reader.read(start, reader.size - start)
+    candidates = sorted(
+        index - 4
+        for chunk_type in PNG_METADATA[1:]
+        for index in _find_all(tail, chunk_type)
+        if index >= 4
+    )
+    for candidate in candidates:
+        kept = []
+        offset = candidate
+        while offset + 12 <= len(tail):
+            length, chunk_type = struct.unpack_from(">I4s", tail, offset)
+            end = offset + length + 12
+            if (
+                chunk_type == b"IDAT"
+                or end > len(tail)
+                or zlib.crc32(tail[offset + 4 : end - 4]) != int.from_bytes(
+                    tail[end - 4 : end], "big"
+                )
+            ):
+                break
+            if chunk_type == b"IEND":
+                if end == len(tail):
+                    return b"".join(kept)
+                break
+            if chunk_type in PNG_METADATA:
+                kept.append(tail[offset:end])
+            offset = end
+    return b""
+
+
+def _find_all(data: bytes, pattern: bytes):
+    index = data.find(pattern)
+    while index >= 0:
+        yield index
+        index = data.find(pattern, index + 1)
+
+
+def _walk_png(reader: RangeReader) -> bytes | None:
+    kept = [PNG_SIGNATURE]
+    offset = len(PNG_SIGNATURE)
+    while len(header := reader.read(offset, 8)) == 8:
+        length, chunk_type = struct.unpack(">I4s", header)
+        if chunk_type == b"IDAT":
+            # the pixels are never walked, each chunk would cost a request
+            data = b"".join(kept)
+            if _needs_pixels(data):
+                return None
+            if scan(data).metadata_size:
+                return data
+            # text may also follow the pixels
+            tail = _png_tail(reader)
+            return None if tail is None else data + tail
+        if chunk_type in PNG_METADATA:
+            chunk = reader.read(offset, length + 12)
+            if len(chunk) < length + 12:
+                break
+            kept.append(chunk)
+        elif chunk_type == b"IEND":
+            break
+        # other chunks are skipped by offset
+        offset += length + 12
+    data = b"".join(kept)
+    return None if _needs_pixels(data) else data
+
+
+def _walk_jpeg(reader: RangeReader) -> bytes:
+    # everything before the first scan is headers and metadata, so the
+    # head of the file is fetched up to it
+    offset = len(JPEG_SIGNATURE)
+    while len(header := reader.read(offset, 4)) >= 2 and header[0] == 0xFF:
+        marker = header[1]
+        if marker in (0xD9, 0xDA) or len(header) < 4:
+            break
+        if marker == 0xFF:
+            offset += 1
+        elif marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            offset += 2
+        else:
+            offset += 2 + struct.unpack(">H", header[2:4])[0]
+    return reader.read(0, offset)
+
+
+def _walk_webp(reader: RangeReader) -> bytes:
+    kept = []
+    offset = 12
+    while len(header := reader.read(offset, 8)) == 8:
+        fourcc, length = struct.unpack("<4sI", header)
+        padded = length + (length & 1)
+        if fourcc in WEBP_METADATA:
+            kept.append(reader.read(offset, 8 + padded))
+        elif fourcc in (b"VP8 ", b"VP8L") and not kept:
+            # a simple file without VP8X, its size is in the image header
+            # and it has no EXIF or XMP, so the truncated chunk comes last
+            kept.append(reader.read(offset, 8 + 30))
+            break
+        offset += 8 + padded
+    body = b"WEBP" + b"".join(kept)
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+
+def fetch(url: str, connections: ConnectionPool = None) -> bytes:
+    """The metadata of a remote image as a buffer for ImageDataReader.
+
+    Only the chunk or segment headers and the metadata are transferred.
+    When an image may hold its metadata in the pixels (stealth pnginfo),
+    or the format is unknown, the whole file is fetched instead.
+    """
+    reader = RangeReader(url, connections)
+    head = reader.fetch(0, HEAD_SIZE - 1)
+    data = None
+    if head[:8] == PNG_SIGNATURE:
+        data = _walk_png(reader)
+    elif head[:2] == JPEG_SIGNATURE:
+        data = _walk_jpeg(reader)
+    elif head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        data = _walk_webp(reader)
+    if data is None:
+        if reader.size is None:
+            data = head + reader.fetch(len(head))
+        else:
+            # only the ranges that were not fetched by the walk
+            data = reader.read(0, reader.size)
+    REMOTE_BYTES.inc(reader.transferred, kind="transferred")
+    REMOTE_BYTES.inc(reader.size or len(data), kind="file")
+    log_event(
+        logger,
+        logging.DEBUG,
+        "远程读取",
+        url=url,
+        requests=reader.requests,
+        transferred=reader.transferred,
+        size=reader.size,
+    )
+    return data
@@ -0,0 +1,111 @@
+__author__ = "receyuki"
+__filename__ = "result.py"
+__copyright__ = "Copyright 2024"
+__email__ = "receyuki@gmail.com"
+
+import json
+from dataclasses import dataclass, field
+
+from .format.base_format import BaseFormat
+
+PARAMETER_FIELDS = tuple(BaseFormat.PARAMETER_KEY)
+# fields that are known once the tool has been classified, before parsing
+DETECTION_FIELDS = frozenset({"tool", "status", "format"})
+FIELDS = (
+    "tool",
+    "status",
+    "format",
+    "width",
+    "height",
+    "positive",
+    "negative",
+    "positive_sdxl",
+    "negative_sdxl",
+    "is_sdxl",
+    "setting",
+    *PARAMETER_FIELDS,
+    "raw",
+)
+FIELD_ALIASES = {
+    "parameter": PARAMETER_FIELDS,
+    "props": tuple(name for name in FIELDS if name != "raw"),
+}
+
+
+def normalize_fields(fields) -> frozenset | None:
+    """Expand a requested field set, None meaning every field."""
+    if fields is None:
+        return None
+    if isinstance(fields, str):
+        fields = [name.strip() for name in fields.split(",") if name.strip()]
+    normalized = set()
+    try:
+        names = iter(fields)
+    except TypeError:
+        raise ValueError(f"Invalid fields: {fields!r}")
+    for name in names:
+        if not isinstance(name, str):
+            raise ValueError(f"Unknown field: {name!r}")
+        if name in FIELD_ALIASES:
+            normalized.update(FIELD_ALIASES[name])
+        elif name in FIELDS:
+            normalized.add(name)
+        else:
+            raise ValueError(f"Unknown field: {name}")
+    return frozenset(normalized)
+
+
+def is_detection_only(fields: frozenset | None) -> bool:
+    return fields is not None and fields <= DETECTION_FIELDS
+
+
+@dataclass(frozen=True, slots=True)
+class ParseResult:
+    """Immutable snapshot of the fields extracted by ImageDataReader.
+
+    Holds no reference to the source file, Pillow's info dict or the parser,
+    so large batches can keep one of these per image instead of the reader.
+    """
+
+    tool: str = ""
+    status: BaseFormat.Status = BaseFormat.Status.UNREAD
+    format: str = ""
+    width: str = ""
+    height: str = ""
+    positive: str = ""
+    negative: str = ""
+    positive_sdxl: dict = field(default_factory=dict)
+    negative_sdxl: dict = field(default_factory=dict)
+    is_sdxl: bool = False
+    setting: str = ""
+    parameter: dict = field(default_factory=dict)
+    raw: str = ""
+
+    @property
+    def props(self):
+        properties = {
+            "positive": self.positive,
+            "negative": self.negative,
+            "positive_sdxl": self.positive_sdxl,
+            "negative_sdxl": self.negative_sdxl,
+            "is_sdxl": self.is_sdxl,
+            **self.parameter,
+            "height": self.height,
+            "width": self.width,
+            "setting": self.setting,
+        }
+        return str(json.dumps(properties))
+
+    def to_dict(self, fields: frozenset | None = None):
+        """Flatten into FIELDS order, limited to fields when given."""
+        data = {}
+        for key in FIELDS:
+            if fields is not None and key not in fields:
+                continue
+            if key in PARAMETER_FIELDS:
+                data[key] = self.parameter.get(key)
+            elif key == "status":
+                data[key] = self.status.name
+            else:
+                data[key] = getattr(self, key)
+        return data
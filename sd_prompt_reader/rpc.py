@@ -0,0 +1,388 @@
+__author__ = "receyuki"
+__filename__ = "rpc.py"
+__copyright__ = "Copyright 2024"
+__email__ = "receyuki@gmail.com"
+
+import inspect
+import itertools
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from .logger import Logger
+from .metrics import CACHE_REQUESTS, registry
+from .pipeline import bounded_map, read_file
+from .result import normalize_fields
+
+JSONRPC = "2.0"
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+# parse results kept by a running server
+CACHE_SIZE = 4096
+# paths the client sends per batch request
+CLIENT_BATCH = 256
+
+logger = Logger("SD_Prompt_Reader.Rpc")
+
+
+class RpcError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+    def to_dict(self):
+        return {"code": self.code, "message": self.message}
+
+
+class ResultCache:
+    """Thread-safe LRU of read records.
+
+    Keyed by path, size, mtime and field set, so a modified file is never
+    answered from the cache.
+    """
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(path, fields: frozenset | None) -> tuple:
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_size, stat.st_mtime_ns, fields
+
+    def get(self, key: tuple) -> dict | None:
+        with self._lock:
+            record = self._items.get(key)
+            if record is None:
+                self.misses += 1
+                CACHE_REQUESTS.inc(result="miss")
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            CACHE_REQUESTS.inc(result="hit")
+            return record
+
+    def put(self, key: tuple, record: dict):
+        with self._lock:
+            self._items[key] = record
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+def _output_path(path: Path, output, suffix: str) -> Path:
+    # the same default names as the write and clear modes of the CLI
+    if output:
+        return Path(output)
+    return path.with_name(f"{path.stem}{suffix}{path.suffix}")
+
+
+class Service:
+    """The methods served over JSON-RPC, shared by every connection.
+
+    Requests carry their params by name. A batch applies read or sniff to
+    a list of paths on the worker pool and streams each record back as a
+    batch.result notification before the final response.
+    """
+
+    def __init__(self, workers: int = 1, cache_size: int = CACHE_SIZE):
+        self.workers = workers
+        self.cache = ResultCache(cache_size)
+        self.methods = {
+            "read": self.read,
+            "sniff": self.sniff,
+            "strip": self.strip,
+            "write": self.write,
+            "metrics": self.metrics,
+        }
+
+    def read(self, path: str, fields=None) -> dict:
+        _check_path(path)
+        if not (
+            fields is None
+            or isinstance(fields, str)
+            or isinstance(fields, list)
+            and all(isinstance(name, str) for name in fields)
+        ):
+            raise RpcError(
+                INVALID_PARAMS, "fields must be a string or a list of strings"
+            )
+        try:
+            fields = normalize_fields(fields or "props")
+        except ValueError as e:
+            raise RpcError(INVALID_PARAMS, str(e))
+        key = self.cache.key(path, fields)
+        record = self.cache.get(key)
+        if record is None:
+            keep = ("raw",) if "raw" in fields else ()
+            result = read_file(path, keep=keep, fields=fields)
+            record = {"file": path, **result.to_dict(fields)}
+            self.cache.put(key, record)
+        return record
+
+    def sniff(self, path: str) -> dict:
+        from .sniff import sniff
+
+        _check_path(path)
+        return {"file": path, **sniff(path).to_dict()}
+
+    def strip(self, path: str, output: str = None) -> dict:
+        from .image_data_reader import ImageDataReader
+
+        _check_path(path, output)
+        source = Path(path)
+        destination = _output_path(source, output, "_data_removed")
+        ImageDataReader.save_image(
+            source, destination, source.suffix.lstrip(".").upper()
+        )
+        return {"file": path, "output": str(destination)}
+
+    def write(
+        self,
+        path: str,
+        output: str = None,
+        data: str = None,
+        positive: str = None,
+        negative: str = None,
+        setting: str = None,
+    ) -> dict:
+        from .image_data_reader import ImageDataReader
+
+        _check_path(path, output)
+        if not data:
+            if not (positive or negative or setting):
+                raise RpcError(INVALID_PARAMS, "Nothing to write")
+            data = ImageDataReader.construct_data(positive, negative, setting)
+        source = Path(path)
+        destination = _output_path(source, output, "_edited")
+        ImageDataReader.save_image(
+            source, destination, source.suffix.lstrip(".").upper(), data
+        )
+        return {"file": path, "output": str(destination)}
+
+    def metrics(self, format: str = "json"):
+        """The metrics of the server, as a dict or as Prometheus text."""
+        if format == "prometheus":
+            return registry.to_prometheus()
+        if format != "json":
+            raise RpcError(INVALID_PARAMS, f"Unsupported metrics format: {format}")
+        return registry.to_dict()
+
+    def batch(self, method: str, paths: list, **params):
+        """Yield one record per path in input order, errors included."""
+        if method not in ("read", "sniff"):
+            raise RpcError(INVALID_PARAMS, f"Unsupported batch method: {method}")
+        if not isinstance(paths, list):
+            raise RpcError(INVALID_PARAMS, "paths must be a list")
+        func = self.methods[method]
+        _bind(func, (None,), params)
+
+        def call(path):
+            try:
+                return func(path, **params)
+            except RpcError as e:
+                return {"file": path, "error": e.to_dict()}
+            except (OSError, ValueError) as e:
+                return {"file": path, "error": {"code": SERVER_ERROR, "message": str(e)}}
+            except Exception as e:
+                logger.exception(f"请求失败：{method}（{e}）")
+                return {"file": path, "error": {"code": SERVER_ERROR, "message": str(e)}}
+
+        yield from bounded_map(call, paths, self.workers)
+
+    def handle(self, line, send):
+        """Answer one request line, calling send with each outgoing message."""
+        try:
+            request = json.loads(line)
+        except ValueError:
+            send(_error(None, RpcError(PARSE_ERROR, "Parse error")))
+            return
+        if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+            send(_error(None, RpcError(INVALID_REQUEST, "Invalid request")))
+            return
+        request_id = request.get("id")
+        method = request["method"]
+        params = request.get("params") or {}
+        try:
+            if not isinstance(params, dict):
+                raise RpcError(INVALID_PARAMS, "params must be an object")
+            if method == "batch":
+                count = 0
+                for record in self.batch(**_bind(self.batch, (), params)):
+                    count += 1
+                    send(
+                        {
+                            "jsonrpc": JSONRPC,
+                            "method": "batch.result",
+                            "params": {"id": request_id, "record": record},
+                        }
+                    )
+                result = {"count": count}
+            elif method in self.methods:
+                func = self.methods[method]
+                result = func(**_bind(func, (), params))
+            else:
+                raise RpcError(METHOD_NOT_FOUND, f"Method not found: {method}")
+        except RpcError as e:
+            response = _error(request_id, e)
+        except (OSError, ValueError) as e:
+            logger.warning(f"请求失败：{method}（{e}）")
+            response = _error(request_id, RpcError(SERVER_ERROR, str(e)))
+        except Exception as e:
+            # a bug hit by one request must not end the connection
+            logger.exception(f"请求失败：{method}（{e}）")
+            response = _error(request_id, RpcError(SERVER_ERROR, str(e)))
+        else:
+            response = {"jsonrpc": JSONRPC, "id": request_id, "result": result}
+        # requests without an id are notifications and get no response
+        if request_id is not None:
+            send(response)
+
+
+def _check_path(path, output=None):
+    # os.stat would take an int as a file descriptor
+    if not isinstance(path, str):
+        raise RpcError(INVALID_PARAMS, "path must be a string")
+    if output is not None and not isinstance(output, str):
+        raise RpcError(INVALID_PARAMS, "output must be a string")
+
+
+def _bind(func, args: tuple, params: dict) -> dict:
+    try:
+        inspect.signature(func).bind(*args, **params)
+    except TypeError as e:
+        raise RpcError(INVALID_PARAMS, str(e))
+    return params
+
+
+def _error(request_id, error: RpcError) -> dict:
+    return {"jsonrpc": JSONRPC, "id": request_id, "error": error.to_dict()}
+
+
+def _encode(message: dict) -> bytes:
+    return (
+        json.dumps(message, ensure_ascii=False, separators=(",", ":")) + "\n"
+    ).encode("utf-8")
+
+
+def serve_stdio(service: Service, stdin=None, stdout=None):
+    """Serve newline-delimited requests from stdin until it is closed."""
+    stdin = stdin or sys.stdin.buffer
+    stdout = stdout or sys.stdout.buffer
+
+    def send(message):
+        stdout.write(_encode(message))
+        stdout.flush()
+
+    for line in stdin:
+        if line.strip():
+            service.handle(line, send)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        def send(message):
+            self.wfile.write(_encode(message))
+
+        try:
+            for line in self.rfile:
+                if line.strip():
+                    self.server.service.handle(line, send)
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug("客户端已断开连接")
+
+
+def serve_unix(service: Service, path):
+    """Serve every connection to a Unix socket on its own thread."""
+    if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+        raise OSError("Unix sockets are not supported on this platform")
+    path = Path(path)
+    if path.is_socket():
+        # left behind by a server that did not shut down cleanly
+        path.unlink()
+    server = socketserver.ThreadingUnixStreamServer(str(path), _Handler)
+    server.daemon_threads = True
+    server.service = service
+    try:
+        # only the owner may talk to the server
+        os.chmod(path, 0o600)
+        logger.info(f"服务已启动：{path}")
+        server.serve_forever()
+    finally:
+        server.server_close()
+        path.unlink(missing_ok=True)
+
+
+class Client:
+    """A connection to serve_unix, one request at a time."""
+
+    def __init__(self, path):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(str(path))
+        self._file = self._socket.makefile("rwb")
+        self._ids = itertools.count(1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def _send(self, method: str, params: dict) -> int:
+        request_id = next(self._ids)
+        self._file.write(
+            _encode(
+                {"jsonrpc": JSONRPC, "id": request_id, "method": method, "params": params}
+            )
+        )
+        self._file.flush()
+        return request_id
+
+    def _messages(self):
+        for line in self._file:
+            yield json.loads(line)
+        raise ConnectionError("Server closed the connection")
+
+    def call(self, method: str, **params):
+        request_id = self._send(method, params)
+        for message in self._messages():
+            if message.get("id") == request_id:
+                if "error" in message:
+                    error = message["error"]
+                    raise RpcError(error["code"], error["message"])
+                return message["result"]
+
+    def batch(self, method: str, paths, **params):
+        """Yield the records of every path, sent CLIENT_BATCH at a time."""
+        paths = iter(paths)
+        while chunk := [str(path) for path in itertools.islice(paths, CLIENT_BATCH)]:
+            request_id = self._send(
+                "batch", {"method": method, "paths": chunk, **params}
+            )
+            for message in self._messages():
+                if message.get("method") == "batch.result":
+                    yield message["params"]["record"]
+                elif message.get("id") == request_id:
+                    if "error" in message:
+                        error = message["error"]
+                        raise RpcError(error["code"], error["message"])
+                    break
@@ -0,0 +1,192 @@
+__author__ = "receyuki"
+__filename__ = "search.py"
+__copyright__ = "Copyright 2024"
+__email__ = "receyuki@gmail.com"
+
+import heapq
+import math
+import os
+import re
+import sqlite3
+from collections import Counter
+
+from .database import BATCH_SIZE, Database
+from .result import ParseResult
+
+# default index location inside the indexed folder
+INDEX_FILE = ".sd_prompt_reader.db"
+# BM25 parameters, the same defaults FTS5 uses
+K1 = 1.2
+B = 0.75
+# SQLite's default limit on host parameters per statement
+MAX_VARIABLES = 999
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS prompt_index
+USING fts5 (positive, negative, model, sampler);
+"""
+
+# fallback when SQLite is built without FTS5, ranked in Python
+INVERTED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    doc INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, doc)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc);
+CREATE TABLE IF NOT EXISTS documents (
+    doc INTEGER PRIMARY KEY,
+    length INTEGER NOT NULL
+);
+"""
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase word tokens, close to FTS5's unicode61 tokenizer."""
+    return re.findall(r"[^\W_]+", text.lower()) if text else []
+
+
+def fts5_available(connection: sqlite3.Connection) -> bool:
+    try:
+        connection.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5 (text)")
+    except sqlite3.OperationalError:
+        return False
+    connection.execute("DROP TABLE temp.fts5_probe")
+    return True
+
+
+class SearchIndex(Database):
+    """Prompt search index on top of the SQLite export.
+
+    Positive and negative prompts, model and sampler are indexed with FTS5
+    when SQLite has it, otherwise with an inverted index in plain tables.
+    Both rank by BM25 and match documents containing every query term.
+    """
+
+    def __init__(self, path, batch_size: int = BATCH_SIZE):
+        super().__init__(path, batch_size)
+        # an existing index keeps its backend
+        if self._table_exists("prompt_index"):
+            self.fts5 = True
+        elif self._table_exists("postings"):
+            self.fts5 = False
+        else:
+            self.fts5 = fts5_available(self._connection)
+        self._connection.executescript(FTS_SCHEMA if self.fts5 else INVERTED_SCHEMA)
+
+    def _table_exists(self, name: str) -> bool:
+        return bool(
+            self._connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = ?", (name,)
+            ).fetchone()
+        )
+
+    def _upsert(self, path: str, stat: os.stat_result, result: ParseResult):
+        super()._upsert(path, stat, result)
+        (doc,) = self._connection.execute(
+            "SELECT rowid FROM images WHERE path = ?", (path,)
+        ).fetchone()
+        columns = (
+            result.positive or " ".join(map(str, result.positive_sdxl.values())),
+            result.negative or " ".join(map(str, result.negative_sdxl.values())),
+            _text(result.parameter.get("model")),
+            _text(result.parameter.get("sampler")),
+        )
+        self._forget([doc])
+        if self.fts5:
+            self._connection.execute(
+                "INSERT INTO prompt_index (rowid, positive, negative, model, sampler) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (doc, *columns),
+            )
+            return
+        terms = Counter(term for column in columns for term in tokenize(column))
+        self._connection.executemany(
+            "INSERT INTO postings VALUES (?, ?, ?)",
+            ((term, doc, tf) for term, tf in terms.items()),
+        )
+        self._connection.execute(
+            "INSERT INTO documents VALUES (?, ?)", (doc, sum(terms.values()))
+        )
+
+    def _forget(self, docs: list):
+        for doc in docs:
+            if self.fts5:
+                self._connection.execute(
+                    "DELETE FROM prompt_index WHERE rowid = ?", (doc,)
+                )
+            else:
+                self._connection.execute("DELETE FROM postings WHERE doc = ?", (doc,))
+                self._connection.execute("DELETE FROM documents WHERE doc = ?", (doc,))
+
+    def search(self, query: str, limit: int = 20) -> list[tuple[str, float]]:
+        """(path, score) pairs of the best matches, higher scores first."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        if self.fts5:
+            # every term quoted, so prompt punctuation is not query syntax
+            match = " ".join(f'"{term}"' for term in terms)
+            return [
+                (path, -score)
+                for path, score in self._connection.execute(
+                    "SELECT images.path, bm25(prompt_index) AS score "
+                    "FROM prompt_index JOIN images ON images.rowid = prompt_index.rowid "
+                    "WHERE prompt_index MATCH ? ORDER BY score LIMIT ?",
+                    (match, limit),
+                )
+            ]
+        return self._search_inverted(terms, limit)
+
+    def _search_inverted(self, terms, limit):
+        total, average = self._connection.execute(
+            "SELECT count(*), avg(length) FROM documents"
+        ).fetchone()
+        if not total:
+            return []
+        # rarest terms first keeps the candidate set small
+        postings = sorted(
+            (
+                dict(
+                    self._connection.execute(
+                        "SELECT doc, tf FROM postings WHERE term = ?", (term,)
+                    ).fetchall()
+                )
+                for term in terms
+            ),
+            key=len,
+        )
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting.keys()
+        if not candidates:
+            return []
+        lengths = self._lookup("documents", "doc", "length", list(candidates))
+        scores = dict.fromkeys(candidates, 0.0)
+        for posting in postings:
+            idf = math.log((total - len(posting) + 0.5) / (len(posting) + 0.5) + 1)
+            for doc in candidates:
+                tf = posting[doc]
+                norm = K1 * (1 - B + B * lengths[doc] / average)
+                scores[doc] += idf * tf * (K1 + 1) / (tf + norm)
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        paths = self._lookup("images", "rowid", "path", [doc for doc, _ in best])
+        return [(paths[doc], score) for doc, score in best]
+
+    def _lookup(self, table: str, key: str, column: str, keys: list) -> dict:
+        found = {}
+        for i in range(0, len(keys), MAX_VARIABLES):
+            chunk = keys[i : i + MAX_VARIABLES]
+            found.update(
+                self._connection.execute(
+                    f"SELECT {key}, {column} FROM {table} "
+                    f"WHERE {key} IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+            )
+        return found
+
+
+def _text(value) -> str:
+    return value.strip() if isinstance(value, str) else str(value or "")
@@ -0,0 +1,45 @@
+__author__ = "receyuki"
+__filename__ = "sniff.py"
+__copyright__ = "Copyright 2024"
+__email__ = "receyuki@gmail.com"
+
+from dataclasses import asdict, dataclass
+
+from .container import scan_file
+from .image_data_reader import ImageDataReader
+
+# chunk and segment contents past this offset are not read
+SNIFF_BYTES = 64 * 1024
+
+
+@dataclass(frozen=True, slots=True)
+class SniffResult:
+    tool: str = ""
+    format: str = ""
+    # bytes of the text, exif and xmp chunks or segments
+    metadata_size: int = 0
+    # an RGBA image without known metadata, may hold stealth pnginfo
+    needs_stealth: bool = False
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def sniff(path, head: int = SNIFF_BYTES) -> SniffResult:
+    """Classify a file from its chunk or segment index alone.
+
+    Only the first head bytes and the chunk headers past them are read,
+    compressed text is never inflated and pixels are never decoded, so
+    tools told apart by the content of a late or compressed chunk are
+    reported by its key alone.
+    """
+    container = scan_file(path, inflate=False, limit=head)
+    if container is None:
+        return SniffResult()
+    reader = ImageDataReader.from_container(container)
+    return SniffResult(
+        tool=reader.tool,
+        format=container.format,
+        metadata_size=container.metadata_size,
+        needs_stealth=reader.needs_stealth,
+    )
@@ -0,0 +1,130 @@
+__author__ = "receyuki"
+__filename__ = "stats.py"
+__copyright__ = "Copyright 2024"
+__email__ = "receyuki@gmail.com"
+
+import re
+from collections import Counter
+from itertools import islice
+
+from .metrics import registry
+from .pipeline import bounded_map, read_file
+from .result import ParseResult
+
+# files read by a worker before its partial aggregate is sent back
+CHUNK_SIZE = 256
+TOP_N = 20
+HISTOGRAMS = (
+    "tool",
+    "status",
+    "model",
+    "sampler",
+    "scheduler",
+    "steps",
+    "cfg",
+    "resolution",
+)
+# everything the histograms and prompt tokens are built from
+FIELDS = frozenset(
+    {"tool", "status", "width", "height", "positive", "setting", "parameter"}
+)
+# A1111 writes "Schedule type", the ComfyUI setting string "Scheduler"
+SCHEDULER_PATTERN = re.compile(r"(?:Scheduler|Schedule type): ([^,\n]+)")
+WEIGHT_PATTERN = re.compile(r":\s*-?[\d.]+$")
+
+
+def prompt_tokens(prompt: str) -> list[str]:
+    """Comma separated prompt tags, without emphasis brackets and weights."""
+    tokens = []
+    for tag in re.split(r"[,\n]", prompt or ""):
+        tag = WEIGHT_PATTERN.sub("", tag.strip().strip("()[]{} ")).strip("()[]{} ")
+        if tag:
+            tokens.append(tag.lower())
+    return tokens
+
+
+def _value(value) -> str | None:
+    value = str(value).strip() if value is not None else ""
+    return value if value and value != "None" else None
+
+
+class Stats:
+    """Counts per histogram plus prompt token counts, mergeable across workers."""
+
+    def __init__(self):
+        self.total = 0
+        self.histograms = {name: Counter() for name in HISTOGRAMS}
+        self.tokens = Counter()
+        # metrics values recorded while collecting, see metrics.drain
+        self.metrics = {}
+
+    def add(self, result: ParseResult):
+        self.total += 1
+        parameter = result.parameter
+        scheduler = SCHEDULER_PATTERN.search(result.setting or "")
+        values = {
+            "tool": result.tool or "Unknown",
+            "status": result.status.name,
+            "model": parameter.get("model"),
+            "sampler": parameter.get("sampler"),
+            "scheduler": scheduler.group(1) if scheduler else None,
+            "steps": parameter.get("steps"),
+            "cfg": parameter.get("cfg"),
+            "resolution": (
+                f"{result.width}x{result.height}"
+                if _value(result.width) and _value(result.height)
+                else None
+            ),
+        }
+        for name, value in values.items():
+            if value := _value(value):
+                self.histograms[name][value] += 1
+        self.tokens.update(prompt_tokens(result.positive))
+
+    def merge(self, other: "Stats"):
+        self.total += other.total
+        for name, counter in other.histograms.items():
+            self.histograms[name].update(counter)
+        self.tokens.update(other.tokens)
+        return self
+
+    def to_dict(self, top: int = TOP_N):
+        return {
+            "total": self.total,
+            **{
+                name: dict(counter.most_common())
+                for name, counter in self.histograms.items()
+            },
+            "prompt_tokens": dict(self.tokens.most_common(top)),
+        }
+
+
+def collect(files, **kwargs) -> Stats:
+    """Partial aggregate of a chunk of files, run inside a worker process."""
+    stats = Stats()
+    for file in files:
+        stats.add(read_file(file, fields=FIELDS, **kwargs))
+    # a worker process sends its metrics back with the aggregate
+    stats.metrics = registry.drain()
+    return stats
+
+
+def chunked(iterable, size: int):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def aggregate(files, workers: int = 1, chunk_size: int = CHUNK_SIZE) -> Stats:
+    """Stream files through the parsers, merging per-chunk partial aggregates.
+
+    With more than one worker the chunks are read in separate processes,
+    only the small Stats objects travel back to be merged.
+    """
+    stats = Stats()
+    for partial in bounded_map(
+        collect, chunked(files, chunk_size), workers, processes=True
+    ):
+        stats.merge(partial)
+        registry.merge(partial.metrics)
+    return stats
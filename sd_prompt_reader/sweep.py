@@ -0,0 +1,162 @@
+__author__ = "receyuki"
+__filename__ = "sweep.py"
+__copyright__ = "Copyright 2024"
+__email__ = "receyuki@gmail.com"
+
+import hashlib
+import json
+from dataclasses import dataclass, field
+
+from .pipeline import SUCCESS_STATUS
+from .result import ParseResult
+
+FREE_KEYS = ("seed",)
+# the setting keys each format writes for a parameter, as in the
+# SETTING_KEY lists of the format classes and the A1111 style settings of
+# ComfyUI, normalized by _normalize_key. InvokeAI names its sampler
+# "scheduler". Other free names only match a setting key of the same name.
+SETTING_ALIASES = {
+    "model": (
+        "model",
+        "model_hash",
+        "ckpt_name",
+        "base_model",
+        "model_weights",
+        "use_stable_diffusion_model",
+    ),
+    "sampler": ("sampler", "sampler_name", "scheduler", "refiner_scheduler"),
+    "seed": ("seed", "noise_seed"),
+    "cfg": (
+        "cfg",
+        "cfg_scale",
+        "cfgscale",
+        "scale",
+        "guidance_scale",
+        "refiner_cfg_scale",
+    ),
+    "steps": ("steps", "num_inference_steps", "refiner_steps"),
+    "size": ("size", "width", "height"),
+}
+# everything the group key is built from
+FIELDS = frozenset(
+    {
+        "tool",
+        "status",
+        "positive",
+        "negative",
+        "positive_sdxl",
+        "negative_sdxl",
+        "setting",
+        "parameter",
+    }
+)
+
+
+def _normalize_key(key: str) -> str:
+    return key.strip().lower().replace(" ", "_")
+
+
+def free_setting_keys(free) -> frozenset:
+    """The normalized setting and parameter keys of the free parameters."""
+    keys = set()
+    for name in free:
+        name = _normalize_key(name)
+        keys.add(name)
+        keys.update(SETTING_ALIASES.get(name, ()))
+    return frozenset(keys)
+
+
+def _is_free(key: str, free: frozenset) -> bool:
+    return _normalize_key(key) in free
+
+
+def normalize_setting(setting: str, free: frozenset) -> list[str]:
+    """The "Key: value" pairs of a setting string, free keys removed.
+
+    The setting carries the sampler flow of A1111 and ComfyUI images, so
+    this is what tells two flows apart beyond the parameter keys. free is
+    a set from free_setting_keys.
+    """
+    pairs = []
+    for pair in (setting or "").split(", "):
+        key, separator, value = pair.partition(": ")
+        if separator and _is_free(key, free):
+            continue
+        pairs.append(pair.strip())
+    return pairs
+
+
+def sweep_key(result: ParseResult, free=FREE_KEYS) -> str:
+    """Hash of everything in the result except the free keys."""
+    free = free_setting_keys(free)
+    data = {
+        "tool": result.tool,
+        "positive": result.positive,
+        "negative": result.negative,
+        "positive_sdxl": result.positive_sdxl,
+        "negative_sdxl": result.negative_sdxl,
+        "parameter": {
+            key: str(value).strip()
+            for key, value in result.parameter.items()
+            if not _is_free(key, free)
+        },
+        "setting": normalize_setting(result.setting, free),
+    }
+    return hashlib.sha256(
+        json.dumps(data, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+@dataclass(slots=True)
+class SweepGroup:
+    key: str
+    tool: str
+    parameter: dict
+    free: dict = field(default_factory=dict)
+    files: list = field(default_factory=list)
+
+    def to_dict(self):
+        return {
+            "key": self.key[:16],
+            "tool": self.tool,
+            "size": len(self.files),
+            "parameter": self.parameter,
+            "free": self.free,
+            "files": self.files,
+        }
+
+
+class SweepGrouper:
+    """Group images by sweep_key in one pass, the corpus is never sorted."""
+
+    def __init__(self, free=FREE_KEYS):
+        self.free = tuple(free)
+        self._free_keys = free_setting_keys(self.free)
+        self.groups = {}
+
+    def add(self, file, result: ParseResult):
+        if result.status not in SUCCESS_STATUS:
+            return
+        key = sweep_key(result, self.free)
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = SweepGroup(
+                key,
+                result.tool,
+                {
+                    name: value
+                    for name, value in result.parameter.items()
+                    if not _is_free(name, self._free_keys)
+                },
+                {name: [] for name in self.free if name in result.parameter},
+            )
+        group.files.append(str(file))
+        for name, values in group.free.items():
+            values.append(result.parameter.get(name))
+
+    def sweeps(self, min_size: int = 2) -> list[SweepGroup]:
+        """Groups of at least min_size images, largest first."""
+        return sorted(
+            (group for group in self.groups.values() if len(group.files) >= min_size),
+            key=lambda group: (-len(group.files), group.files[0]),
+        )
@@ -0,0 +1,188 @@
+__author__ = "receyuki"
+__filename__ = "timing.py"
+__copyright__ = "Copyright 2024"
+__email__ = "receyuki@gmail.com"
+
+# Per-stage timing for --profile. Nothing is recorded until enable() is
+# called, a disabled stage is a shared no-op context manager.
+
+import json
+import os
+import threading
+import time
+import unicodedata
+from contextlib import nullcontext
+
+# percentiles reported per tool
+PERCENTILES = (50, 95, 99)
+
+_DISABLED = nullcontext()
+_profiler = None
+
+
+class Profiler:
+    """Durations of every stage and of every file, grouped by tool.
+
+    Stages nest, so a stage's total includes the stages inside it. With
+    trace set, each stage and file is also kept as a Chrome trace event.
+    """
+
+    def __init__(self, trace: bool = False):
+        self.trace = trace
+        self.started = time.perf_counter()
+        # stage name -> durations in seconds
+        self.stages = {}
+        # tool -> durations of whole files in seconds
+        self.files = {}
+        self.events = []
+        self._lock = threading.Lock()
+
+    def record(self, name: str, start: float, end: float, category="stage", **args):
+        with self._lock:
+            durations = self.stages if category == "stage" else self.files
+            durations.setdefault(name, []).append(end - start)
+            if self.trace:
+                self.events.append(
+                    {
+                        "name": name,
+                        "cat": category,
+                        "ph": "X",
+                        "ts": round((start - self.started) * 1e6, 1),
+                        "dur": round((end - start) * 1e6, 1),
+                        "pid": os.getpid(),
+                        "tid": threading.get_ident(),
+                        "args": args,
+                    }
+                )
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            stages = {
+                name: {
+                    "count": len(durations),
+                    "total_ms": _ms(sum(durations)),
+                    "mean_ms": _ms(sum(durations) / len(durations)),
+                }
+                for name, durations in self.stages.items()
+            }
+            tools = {
+                tool: {
+                    "count": len(durations),
+                    "total_ms": _ms(sum(durations)),
+                    **{
+                        f"p{p}_ms": _ms(_percentile(sorted(durations), p))
+                        for p in PERCENTILES
+                    },
+                }
+                for tool, durations in self.files.items()
+            }
+        return {
+            "wall_ms": _ms(time.perf_counter() - self.started),
+            "stages": stages,
+            "tools": tools,
+        }
+
+    def format_report(self) -> str:
+        report = self.to_dict()
+        stages = sorted(
+            report["stages"].items(), key=lambda item: -item[1]["total_ms"]
+        )
+        tools = sorted(report["tools"].items())
+        name_width = max([len(name) for name, _ in stages + tools] + [8]) + 2
+        lines = [f"总耗时：{report['wall_ms']:.1f} ms", ""]
+        lines.append(
+            _cell("阶段", name_width, left=True)
+            + "".join(_cell(title, 12) for title in ("次数", "总计(ms)", "平均(ms)"))
+        )
+        for name, stats in stages:
+            lines.append(
+                _cell(name, name_width, left=True)
+                + _cell(stats["count"], 12)
+                + _cell(f"{stats['total_ms']:.1f}", 12)
+                + _cell(f"{stats['mean_ms']:.3f}", 12)
+            )
+        lines.append("")
+        lines.append(
+            _cell("工具", name_width, left=True)
+            + "".join(_cell(title, 12) for title in ("文件数", "总计(ms)"))
+            + "".join(_cell(f"p{p}(ms)", 12) for p in PERCENTILES)
+        )
+        for tool, stats in tools:
+            lines.append(
+                _cell(tool, name_width, left=True)
+                + _cell(stats["count"], 12)
+                + _cell(f"{stats['total_ms']:.1f}", 12)
+                + "".join(_cell(f"{stats[f'p{p}_ms']:.3f}", 12) for p in PERCENTILES)
+            )
+        return "\n".join(lines)
+
+    def write_trace(self, path):
+        """Write the events as a Chrome trace, for Perfetto or about:tracing."""
+        with self._lock:
+            events = list(self.events)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+class _Stage:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: Profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter())
+
+
+def enable(trace: bool = False) -> Profiler:
+    global _profiler
+    _profiler = Profiler(trace)
+    return _profiler
+
+
+def disable() -> Profiler | None:
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def stage(name: str):
+    """Time the enclosed block as one run of the named stage."""
+    profiler = _profiler
+    return _DISABLED if profiler is None else _Stage(profiler, name)
+
+
+def record_file(file, tool: str, start: float):
+    """Record a whole file read that began at perf_counter() start."""
+    profiler = _profiler
+    if profiler is not None:
+        tool = tool.replace("\n", " ") if tool else "Unknown"
+        profiler.record(
+            tool, start, time.perf_counter(), category="file", file=str(file)
+        )
+
+
+def _percentile(durations: list, p: int) -> float:
+    # nearest rank on sorted durations
+    index = max(0, -(-len(durations) * p // 100) - 1)
+    return durations[index]
+
+
+def _cell(value, width: int, left: bool = False) -> str:
+    # CJK headers take two columns each
+    text = str(value)
+    padding = " " * max(
+        0,
+        width
+        - sum(2 if unicodedata.east_asian_width(c) in "WF" else 1 for c in text),
+    )
+    return text + padding if left else padding + text
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
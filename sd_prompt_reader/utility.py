@@ -14,6 +14,14 @@ except ImportError:
     pass
 
 from .constants import *
+from .string_utility import (
+    add_quotes,
+    concat_strings,
+    merge_dict,
+    merge_str_to_tuple,
+    remove_quotes,
+)
+from .walker import walk
 
 
 def load_icon(icon_file, size):
@@ -24,12 +32,8 @@ def load_icon(icon_file, size):
 
 
 def get_images(dir_path: Path):
-    images = [
-        image.resolve()
-        for image in dir_path.rglob("*")
-        if image.suffix in SUPPORTED_FORMATS
-    ]
-    return images
+    # resolve the root once, paths below it are already absolute
+    return list(walk(dir_path.resolve(), recursive=True))
 
 
 def select_image(file_path=None):
@@ -125,30 +129,3 @@ def ease_in_out(t, b, c, d):
         return c / 2 * t * t * t + b
     t -= 2
     return c / 2 * (t * t * t + 2) + b
-
-
-def merge_str_to_tuple(item1, item2):
-    if not isinstance(item1, tuple):
-        item1 = (item1,)
-    if not isinstance(item2, tuple):
-        item2 = (item2,)
-    return item1 + item2
-
-
-def merge_dict(dict1, dict2):
-    dict3 = dict1.copy()
-    for k, v in dict2.items():
-        dict3[k] = merge_str_to_tuple(v, dict3[k]) if k in dict3 else v
-    return dict3
-
-
-def remove_quotes(string):
-    return str(string).replace('"', "").replace("'", "")
-
-
-def add_quotes(string):
-    return f'"{str(string)}"'
-
-
-def concat_strings(base, addition, separator=", "):
-    return f"{base}{separator}{addition}" if base else addition
@@ -0,0 +1,176 @@
+__author__ = "receyuki"
+__filename__ = "walker.py"
+__copyright__ = "Copyright 2024"
+__email__ = "receyuki@gmail.com"
+
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from pathlib import Path
+
+from .constants import SUPPORTED_FORMATS
+from .logger import Logger
+
+# files buffered per walk thread before the consumer has to catch up
+QUEUE_PER_WORKER = 256
+# bytes taken from a path stream at a time, read1 returns early with
+# whatever has arrived
+READ_SIZE = 64 * 1024
+
+logger = Logger("SD_Prompt_Reader.Walker")
+
+
+def walk(
+    root,
+    recursive: bool = False,
+    include=(),
+    exclude=(),
+    max_depth: int = None,
+    workers: int = 1,
+    suffixes=SUPPORTED_FORMATS,
+):
+    """Yield image files under root as they are found.
+
+    Suffixes are matched case-insensitively. include and exclude are glob
+    patterns matched against the path relative to root, or against the
+    name alone when the pattern has no slash; excluded directories are not
+    entered. max_depth counts directory levels below root and implies
+    recursive. With more than one worker, directories are scanned in
+    parallel and files are yielded in no particular order.
+    """
+    if max_depth is None:
+        max_depth = None if recursive else 0
+    walker = _Walker(
+        Path(root),
+        tuple(include),
+        tuple(exclude),
+        max_depth,
+        frozenset(suffix.lower() for suffix in suffixes),
+    )
+    if workers <= 1:
+        return walker.walk()
+    return walker.walk_parallel(workers)
+
+
+def read_paths(stream, separator: bytes = b"\n"):
+    """Yield the paths in a binary stream as soon as each one is complete.
+
+    Paths are separated by newlines, or by NUL bytes as printed by
+    find -print0 and fd -0, and decoded like os.fsdecode so any file name
+    survives. Empty entries are skipped; the rest are yielded as given,
+    without filtering by suffix or checking that they exist.
+    """
+    read = getattr(stream, "read1", stream.read)
+    pending = b""
+    while chunk := read(READ_SIZE):
+        *entries, pending = (pending + chunk).split(separator)
+        for entry in entries:
+            if path := _decode(entry, separator):
+                yield path
+    if path := _decode(pending, separator):
+        yield path
+
+
+def _decode(entry: bytes, separator: bytes) -> str:
+    if separator == b"\n":
+        entry = entry.removesuffix(b"\r")
+    return os.fsdecode(entry)
+
+
+class _Walker:
+    def __init__(self, root, include, exclude, max_depth, suffixes):
+        self.root = root
+        self.include = include
+        self.exclude = exclude
+        self.max_depth = max_depth
+        self.suffixes = suffixes
+
+    def walk(self):
+        stack = [(self.root, "", 0)]
+        while stack:
+            files, subdirs = self.scan(*stack.pop())
+            yield from files
+            # reversed so directories are visited in the order listed
+            stack.extend(reversed(subdirs))
+
+    def walk_parallel(self, workers):
+        found = queue.Queue(maxsize=workers * QUEUE_PER_WORKER)
+        stop = threading.Event()
+        pending = 1
+        lock = threading.Lock()
+        done = object()
+
+        def put(item):
+            # give up once the consumer has gone away
+            while not stop.is_set():
+                try:
+                    found.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def task(directory):
+            nonlocal pending
+            try:
+                files, subdirs = self.scan(*directory)
+                for subdir in subdirs:
+                    with lock:
+                        pending += 1
+                    executor.submit(task, subdir)
+                for file in files:
+                    put(file)
+            finally:
+                with lock:
+                    pending -= 1
+                    finished = not pending
+                if finished:
+                    put(done)
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            executor.submit(task, (self.root, "", 0))
+            while (item := found.get()) is not done:
+                yield item
+        finally:
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def scan(self, directory: Path, relative: str, depth: int):
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    name = entry.name
+                    path = f"{relative}/{name}" if relative else name
+                    try:
+                        # directory symlinks are not followed to avoid loops
+                        if entry.is_dir(follow_symlinks=False):
+                            if (
+                                self.max_depth is None or depth < self.max_depth
+                            ) and not self.match(self.exclude, path, name):
+                                subdirs.append((directory / name, path, depth + 1))
+                        elif (
+                            os.path.splitext(name)[1].lower() in self.suffixes
+                            and entry.is_file()
+                            and self.accept(path, name)
+                        ):
+                            files.append(directory / name)
+                    except OSError as e:
+                        logger.warning(f"无法访问：{entry.path}（{e}）")
+        except OSError as e:
+            logger.warning(f"无法读取目录：{directory}（{e}）")
+        return files, subdirs
+
+    def accept(self, path, name):
+        if self.include and not self.match(self.include, path, name):
+            return False
+        return not self.match(self.exclude, path, name)
+
+    @staticmethod
+    def match(patterns, path, name):
+        return any(
+            fnmatch(path if "/" in pattern else name, pattern) for pattern in patterns
+        )
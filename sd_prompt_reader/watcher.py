@@ -0,0 +1,238 @@
+__author__ = "receyuki"
+__filename__ = "watcher.py"
+__copyright__ = "Copyright 2024"
+__email__ = "receyuki@gmail.com"
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+
+from .constants import SUPPORTED_FORMATS
+from .logger import Logger
+from .walker import _Walker
+
+# seconds a file's size and mtime must hold still before it is read
+DEBOUNCE = 1.0
+# seconds between directory checks of the poller, and the longest wait
+# for inotify events
+POLL_INTERVAL = 1.0
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT = struct.Struct("iIII")
+READ_SIZE = 64 * 1024
+
+logger = Logger("SD_Prompt_Reader.Watcher")
+
+
+def watch(
+    root,
+    recursive: bool = False,
+    include=(),
+    exclude=(),
+    max_depth: int = None,
+    suffixes=SUPPORTED_FORMATS,
+    debounce: float = DEBOUNCE,
+    poll: bool = False,
+):
+    """Yield lists of image files under root as their writes complete.
+
+    Files present when watching starts are not reported. A new or
+    rewritten file is reported once its size and mtime have held still
+    for debounce seconds. inotify is used on Linux unless poll is set,
+    otherwise directories are polled and only those whose mtime changed
+    are listed again. The poller only notices new files, not files
+    rewritten in place. Runs until the consumer stops iterating.
+    include, exclude and max_depth are the same as for walk.
+    """
+    if max_depth is None:
+        max_depth = None if recursive else 0
+    walker = _Walker(
+        Path(root),
+        tuple(include),
+        tuple(exclude),
+        max_depth,
+        frozenset(suffix.lower() for suffix in suffixes),
+    )
+    backend = None
+    if not poll:
+        try:
+            backend = _Inotify(walker)
+        except OSError as e:
+            logger.info(f"inotify 不可用，改用轮询（{e}）")
+    if backend is None:
+        backend = _Poller(walker)
+    with backend:
+        yield from _Debouncer(backend, debounce).batches()
+
+
+class _Debouncer:
+    """Hold candidate files until their size and mtime stop changing."""
+
+    def __init__(self, backend, debounce: float):
+        self.backend = backend
+        self.debounce = debounce
+        # path -> (size, mtime_ns, monotonic time of the last change)
+        self.pending = {}
+
+    def batches(self):
+        while True:
+            timeout = min(POLL_INTERVAL, self.debounce / 2) if self.pending else None
+            now = time.monotonic()
+            for path in self.backend.changes(timeout):
+                self.pending.setdefault(path, (-1, -1, now))
+            if ready := self.ready(time.monotonic()):
+                yield ready
+
+    def ready(self, now: float) -> list:
+        ready = []
+        for path, (size, mtime, since) in list(self.pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # deleted or renamed away before it settled
+                del self.pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                self.pending[path] = (stat.st_size, stat.st_mtime_ns, now)
+            elif stat.st_size and now - since >= self.debounce:
+                del self.pending[path]
+                ready.append(path)
+        return ready
+
+
+class _Poller:
+    """Find new files by listing directories whose mtime changed."""
+
+    def __init__(self, walker: _Walker):
+        self.walker = walker
+        # directory -> [mtime_ns, relative path, depth, set of files]
+        self.directories = {}
+        self.scan((walker.root, "", 0), report=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def scan(self, directory: tuple, report: bool = True) -> list:
+        path, relative, depth = directory
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            self.directories.pop(path, None)
+            return []
+        files, subdirs = self.walker.scan(path, relative, depth)
+        known = self.directories.get(path)
+        new = [file for file in files if not known or file not in known[3]]
+        self.directories[path] = [mtime, relative, depth, set(files)]
+        for subdir in subdirs:
+            if subdir[0] not in self.directories:
+                new.extend(self.scan(subdir, report))
+        return new if report else []
+
+    def changes(self, timeout: float | None) -> list:
+        time.sleep(POLL_INTERVAL if timeout is None else timeout)
+        changed = []
+        for path, (mtime, relative, depth, _) in list(self.directories.items()):
+            try:
+                current = os.stat(path).st_mtime_ns
+            except OSError:
+                del self.directories[path]
+                continue
+            if current != mtime:
+                changed.extend(self.scan((path, relative, depth)))
+        return changed
+
+
+class _Inotify:
+    """Linux inotify through libc, one watch per directory."""
+
+    def __init__(self, walker: _Walker):
+        if not sys.platform.startswith("linux"):
+            raise OSError("not Linux")
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self.walker = walker
+        # watch descriptor -> (directory, relative path, depth)
+        self.watches = {}
+        self.add((walker.root, "", 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        os.close(self.fd)
+
+    def add(self, directory: tuple) -> list:
+        """Watch a directory tree, returning the files already in it."""
+        path, relative, depth = directory
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            logger.warning(f"无法监视目录：{path}（{os.strerror(ctypes.get_errno())}）")
+            return []
+        self.watches[wd] = directory
+        # files written before the watch was added would be missed
+        files, subdirs = self.walker.scan(path, relative, depth)
+        for subdir in subdirs:
+            files.extend(self.add(subdir))
+        return files
+
+    def changes(self, timeout: float | None) -> list:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return []
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size : offset + EVENT.size + length]
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify 事件队列溢出，部分文件可能被遗漏")
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches:
+                continue
+            directory, relative, depth = self.watches[wd]
+            name = os.fsdecode(name.rstrip(b"\0"))
+            child = f"{relative}/{name}" if relative else name
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and self.enter(child, name, depth):
+                    changed.extend(self.add((directory / name, child, depth + 1)))
+            elif self.accept(child, name):
+                changed.append(directory / name)
+        return changed
+
+    def enter(self, relative: str, name: str, depth: int) -> bool:
+        walker = self.walker
+        return (walker.max_depth is None or depth < walker.max_depth) and not (
+            walker.match(walker.exclude, relative, name)
+        )
+
+    def accept(self, relative: str, name: str) -> bool:
+        return os.path.splitext(name)[1].lower() in self.walker.suffixes and (
+            self.walker.accept(relative, name)
+        )
@@ -0,0 +1,69 @@
+import io
+import re
+
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+from sd_prompt_reader.image_data_reader import ImageDataReader
+from sd_prompt_reader.remote import HEAD_SIZE, RangeReader, fetch
+
+
+class FilePool:
+    """Serves Range requests from bytes, in place of ConnectionPool."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def request(self, url: str, headers: dict) -> tuple[int, dict, bytes]:
+        start, end = re.fullmatch(r"bytes=(\d+)-(\d*)", headers["Range"]).groups()
+        start = int(start)
+        end = min(int(end) if end else len(self.data) - 1, len(self.data) - 1)
+        if start >= len(self.data):
+            return 416, {}, b""
+        return (
+            206,
+            {"content-range": f"bytes {start}-{end}/{len(self.data)}"},
+            self.data[start : end + 1],
+        )
+
+
+def png(text: str) -> bytes:
+    info = PngInfo()
+    info.add_text("parameters", text)
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64)).save(buffer, "PNG", pnginfo=info)
+    return buffer.getvalue()
+
+
+def test_metadata_across_head_size_is_fetched_once(monkeypatch):
+    # the text chunk starts in the first request and ends after it
+    data = png("a cat, " * (HEAD_SIZE // 6) + "\nSteps: 20, Seed: 1")
+    assert data.find(b"tEXt") < HEAD_SIZE < data.find(b"IDAT")
+    readers = []
+
+    class Reader(RangeReader):
+        def __init__(self, *args):
+            super().__init__(*args)
+            readers.append(self)
+
+    monkeypatch.setattr("sd_prompt_reader.remote.RangeReader", Reader)
+    fetched = fetch("http://example.com/a.png", FilePool(data))
+    (reader,) = readers
+    assert reader.transferred <= len(data)
+    assert (
+        ImageDataReader.from_buffer(fetched).result.to_dict()
+        == ImageDataReader.from_buffer(data).result.to_dict()
+    )
+
+
+def test_read_fetches_only_missing_bytes():
+    data = bytes(range(256)) * 256
+    reader = RangeReader("http://example.com/a.bin", FilePool(data))
+    assert reader.fetch(0, 999) == data[:1000]
+    assert reader.read(500, 1000) == data[500:1500]
+    assert reader.transferred == 1000 + 4096
+    assert reader.read(0, 5096) == data[:5096]
+    assert reader.read(10000, 10) == data[10000:10010]
+    assert reader.read(0, len(data)) == data
+    assert reader.transferred == len(data)
+    assert len(reader._blocks) == 1
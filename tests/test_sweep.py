@@ -0,0 +1,51 @@
+import io
+
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+from sd_prompt_reader.image_data_reader import ImageDataReader
+from sd_prompt_reader.sweep import SweepGrouper, sweep_key
+
+PROMPT = "a cat\nNegative prompt: blurry\n"
+SETTING = (
+    "Steps: 20, Sampler: DPM++ 2M Karras, CFG scale: {cfg}, Seed: {seed}, "
+    "Size: 512x768, Model hash: {hash}, Model: {model}, Version: v1.7.0"
+)
+
+
+def a1111(cfg=7, seed=1, model="sd15", hash="abc123"):
+    info = PngInfo()
+    info.add_text(
+        "parameters",
+        PROMPT + SETTING.format(cfg=cfg, seed=seed, model=model, hash=hash),
+    )
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(buffer, "PNG", pnginfo=info)
+    return ImageDataReader.from_buffer(buffer.getvalue()).result
+
+
+def test_free_cfg_matches_cfg_scale():
+    cfg_5, cfg_6 = a1111(cfg=5), a1111(cfg=6)
+    assert sweep_key(cfg_5) != sweep_key(cfg_6)
+    assert sweep_key(cfg_5, ("seed", "cfg")) == sweep_key(cfg_6, ("seed", "cfg"))
+
+
+def test_free_model_matches_model_hash():
+    sd15 = a1111(model="sd15", hash="abc123")
+    sdxl = a1111(model="sdxl", hash="def456")
+    assert sweep_key(sd15, ("model",)) == sweep_key(sdxl, ("model",))
+
+
+def test_free_seed_keeps_other_settings():
+    assert sweep_key(a1111(seed=1)) == sweep_key(a1111(seed=2))
+    assert sweep_key(a1111(seed=1)) != sweep_key(a1111(seed=2, cfg=8))
+
+
+def test_grouper_groups_a_cfg_sweep():
+    grouper = SweepGrouper(("seed", "cfg"))
+    for cfg in (5, 6, 7):
+        grouper.add(f"cfg_{cfg}.png", a1111(cfg=cfg, seed=cfg))
+    (group,) = grouper.sweeps()
+    assert group.files == ["cfg_5.png", "cfg_6.png", "cfg_7.png"]
+    assert group.free == {"seed": ["5", "6", "7"], "cfg": ["5", "6", "7"]}
+    assert "cfg" not in group.parameter